@@ -1,8 +1,17 @@
 """
 User Intent MCP - A multimodal user intent collection server for AI agents.
 """
-from core import mcp, collect_user_intent, init_db, DB_PATH, DATA_DIR
 
 __version__ = "1.0.0"
 __all__ = ["mcp", "collect_user_intent", "init_db", "DB_PATH", "DATA_DIR"]
 
+# Lazy attribute access (PEP 562) - importing this package stays cheap;
+# the full server stack in core only loads when one of these is used.
+_LAZY_ATTRS = frozenset(__all__)
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        import core
+        return getattr(core, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
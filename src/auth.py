@@ -2,13 +2,27 @@
 认证模块 - 管理员认证和会话管理
 """
 
+import functools
 import os
 import sqlite3
 import hashlib
 import secrets
+import threading
 import time
 from typing import Optional, Dict, Any
 from dataclasses import dataclass
+from collections import OrderedDict
+
+
+# 模块级 SQL 常量 - 相同的 SQL 字面量配合长连接可复用 sqlite3 已编译的语句
+_SQL_GET_PASSWORD_HASH = "SELECT value FROM admin_config WHERE key = 'password_hash'"
+_SQL_GET_USERNAME = "SELECT value FROM admin_config WHERE key = 'admin_username'"
+_SQL_GET_CREDENTIALS = (
+    "SELECT key, value FROM admin_config "
+    "WHERE key IN ('admin_username', 'password_hash')"
+)
+_SQL_GET_SESSION = "SELECT expires_at FROM admin_sessions WHERE token = ?"
+_SQL_DELETE_SESSION = "DELETE FROM admin_sessions WHERE token = ?"
 
 
 @dataclass
@@ -24,37 +38,56 @@ class AdminAuth:
     
     # 会话有效期：24小时
     SESSION_EXPIRY = 24 * 60 * 60
+
+    # 会话验证缓存：短 TTL，命中时跳过数据库查询
+    SESSION_CACHE_TTL = 30
+    SESSION_CACHE_MAX = 10000
     
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # 长连接 - 避免每次调用重新打开数据库并重新编译 SQL
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # 写操作需要加锁（连接跨线程共享）
+        self._write_lock = threading.Lock()
+        # token -> (expires_at, cached_at)，LRU 淘汰
+        self._session_cache: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        # 用户名错误时也对该哈希做一次校验，避免时序侧信道暴露用户名
+        self._dummy_hash = self._hash_password("dummy-password-placeholder")
+        # WAL 模式：读（validate_session）不再被写（create_session）阻塞
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn.execute("PRAGMA cache_size=-8000")  # 8 MiB
         self._init_db()
-    
+
     def _init_db(self):
         """初始化数据库表"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
+        with self._conn:
+            self._conn.execute('''
                 CREATE TABLE IF NOT EXISTS admin_config (
                     key TEXT PRIMARY KEY,
                     value TEXT NOT NULL
                 )
             ''')
             # 会话表 - 持久化存储
-            conn.execute('''
+            self._conn.execute('''
                 CREATE TABLE IF NOT EXISTS admin_sessions (
                     token TEXT PRIMARY KEY,
                     created_at REAL NOT NULL,
                     expires_at REAL NOT NULL
                 )
             ''')
+            # 过期清理按 expires_at 范围扫描，避免全表扫描
+            self._conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sessions_expires
+                ON admin_sessions(expires_at)
+            ''')
     
     def is_initialized(self) -> bool:
         """检查系统是否已初始化（已设置管理员密码）"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "SELECT value FROM admin_config WHERE key = 'password_hash'"
-            )
-            row = cursor.fetchone()
-            return row is not None
+        cursor = self._conn.execute(_SQL_GET_PASSWORD_HASH)
+        row = cursor.fetchone()
+        return row is not None
     
     def initialize(self, username: str = "admin", password: str = "") -> bool:
         """
@@ -80,42 +113,37 @@ class AdminAuth:
         # 生成密码哈希
         password_hash = self._hash_password(password)
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self._write_lock, self._conn:
             # 检查是否已初始化
-            cursor = conn.execute(
-                "SELECT value FROM admin_config WHERE key = 'password_hash'"
-            )
+            cursor = self._conn.execute(_SQL_GET_PASSWORD_HASH)
             if cursor.fetchone():
                 return False  # 已初始化
-            
+
             # 存储用户名
-            conn.execute(
+            self._conn.execute(
                 "INSERT INTO admin_config (key, value) VALUES (?, ?)",
                 ("admin_username", username)
             )
-            
+
             # 存储密码哈希
-            conn.execute(
+            self._conn.execute(
                 "INSERT INTO admin_config (key, value) VALUES (?, ?)",
                 ("password_hash", password_hash)
             )
-            
+
             # 记录初始化时间
-            conn.execute(
+            self._conn.execute(
                 "INSERT OR REPLACE INTO admin_config (key, value) VALUES (?, ?)",
                 ("initialized_at", str(int(time.time())))
             )
-        
+
         return True
     
     def get_admin_username(self) -> str:
         """获取管理员用户名"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "SELECT value FROM admin_config WHERE key = 'admin_username'"
-            )
-            row = cursor.fetchone()
-            return row[0] if row else "admin"
+        cursor = self._conn.execute(_SQL_GET_USERNAME)
+        row = cursor.fetchone()
+        return row[0] if row else "admin"
     
     def verify_credentials(self, username: str, password: str) -> bool:
         """
@@ -128,28 +156,28 @@ class AdminAuth:
         Returns:
             bool: 凭证是否正确
         """
-        with sqlite3.connect(self.db_path) as conn:
-            # 验证用户名
-            cursor = conn.execute(
-                "SELECT value FROM admin_config WHERE key = 'admin_username'"
-            )
-            row = cursor.fetchone()
-            stored_username = row[0] if row else "admin"
-            
-            if username != stored_username:
-                return False
-            
-            # 验证密码
-            cursor = conn.execute(
-                "SELECT value FROM admin_config WHERE key = 'password_hash'"
-            )
-            row = cursor.fetchone()
-            
-            if not row:
-                return False
-            
-            stored_hash = row[0]
-            return self._verify_hash(password, stored_hash)
+        # 一次查询同时取出用户名和密码哈希
+        cursor = self._conn.execute(_SQL_GET_CREDENTIALS)
+        config = {key: value for key, value in cursor.fetchall()}
+
+        stored_username = config.get("admin_username", "admin")
+        stored_hash = config.get("password_hash")
+
+        # 常数时间比较用户名；不匹配时也跑一次哈希校验，
+        # 使"用户名错误"与"密码错误"耗时一致
+        username_ok = secrets.compare_digest(
+            username.encode('utf-8'), stored_username.encode('utf-8')
+        )
+
+        if not stored_hash:
+            self._verify_hash(password, self._dummy_hash)
+            return False
+
+        password_ok = self._verify_hash(
+            password, stored_hash if username_ok else self._dummy_hash
+        )
+
+        return username_ok and password_ok
     
     def verify_password(self, password: str) -> bool:
         """
@@ -161,17 +189,14 @@ class AdminAuth:
         Returns:
             bool: 密码是否正确
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "SELECT value FROM admin_config WHERE key = 'password_hash'"
-            )
-            row = cursor.fetchone()
-            
-            if not row:
-                return False
-            
-            stored_hash = row[0]
-            return self._verify_hash(password, stored_hash)
+        cursor = self._conn.execute(_SQL_GET_PASSWORD_HASH)
+        row = cursor.fetchone()
+
+        if not row:
+            return False
+
+        stored_hash = row[0]
+        return self._verify_hash(password, stored_hash)
     
     def change_password(self, old_password: str, new_password: str) -> bool:
         """
@@ -196,12 +221,15 @@ class AdminAuth:
         
         # 更新密码
         new_hash = self._hash_password(new_password)
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
+        with self._write_lock, self._conn:
+            self._conn.execute(
                 "UPDATE admin_config SET value = ? WHERE key = 'password_hash'",
                 (new_hash,)
             )
-        
+
+        # 凭据轮换后整体清掉会话验证缓存
+        self._session_cache.clear()
+
         return True
     
     def create_session(self) -> str:
@@ -211,18 +239,21 @@ class AdminAuth:
         Returns:
             str: 会话令牌
         """
-        token = secrets.token_hex(32)  # 64字符
+        token = secrets.token_urlsafe(32)  # 43字符，与 64 字符 hex 等熵
         now = time.time()
         expires_at = now + self.SESSION_EXPIRY
         
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
+        # 插入与过期清理放在同一事务中，只产生一次提交
+        with self._write_lock, self._conn:
+            self._conn.execute(
                 "INSERT INTO admin_sessions (token, created_at, expires_at) VALUES (?, ?, ?)",
                 (token, now, expires_at)
             )
-        
-        self._cleanup_expired_sessions()
-        
+            self._conn.execute(
+                "DELETE FROM admin_sessions WHERE expires_at < ?",
+                (now,)
+            )
+
         return token
     
     def validate_session(self, token: str) -> bool:
@@ -236,24 +267,33 @@ class AdminAuth:
             bool: 会话是否有效
         """
         now = time.time()
-        
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "SELECT expires_at FROM admin_sessions WHERE token = ?",
-                (token,)
-            )
-            row = cursor.fetchone()
-            
-            if not row:
-                return False
-            
-            expires_at = row[0]
-            
-            if now > expires_at:
-                conn.execute("DELETE FROM admin_sessions WHERE token = ?", (token,))
-                return False
-            
-            return True
+
+        # 先查缓存，命中且未过期则跳过数据库
+        cached = self._session_cache.get(token)
+        if cached:
+            expires_at, cached_at = cached
+            if now - cached_at < self.SESSION_CACHE_TTL and now < expires_at:
+                self._session_cache.move_to_end(token)
+                return True
+            self._session_cache.pop(token, None)
+
+        cursor = self._conn.execute(_SQL_GET_SESSION, (token,))
+        row = cursor.fetchone()
+
+        if not row:
+            return False
+
+        expires_at = row[0]
+
+        if now > expires_at:
+            with self._write_lock, self._conn:
+                self._conn.execute(_SQL_DELETE_SESSION, (token,))
+            return False
+
+        self._session_cache[token] = (expires_at, now)
+        while len(self._session_cache) > self.SESSION_CACHE_MAX:
+            self._session_cache.popitem(last=False)
+        return True
     
     def invalidate_session(self, token: str):
         """
@@ -262,8 +302,9 @@ class AdminAuth:
         Args:
             token: 会话令牌
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("DELETE FROM admin_sessions WHERE token = ?", (token,))
+        self._session_cache.pop(token, None)
+        with self._write_lock, self._conn:
+            self._conn.execute(_SQL_DELETE_SESSION, (token,))
     
     def _validate_password(self, password: str):
         """
@@ -281,41 +322,53 @@ class AdminAuth:
     def _hash_password(self, password: str) -> str:
         """
         生成密码哈希
-        
+
         Args:
             password: 原始密码
-            
+
         Returns:
-            str: 密码哈希（salt:hash 格式）
+            str: 密码哈希（scrypt$salt$hash 格式）
         """
         salt = secrets.token_hex(16)
-        hash_value = hashlib.pbkdf2_hmac(
-            'sha256',
+        hash_value = hashlib.scrypt(
             password.encode('utf-8'),
-            salt.encode('utf-8'),
-            100000
+            salt=salt.encode('utf-8'),
+            n=2**14, r=8, p=1, dklen=32
         ).hex()
-        return f"{salt}:{hash_value}"
-    
+        return f"scrypt${salt}${hash_value}"
+
     def _verify_hash(self, password: str, stored_hash: str) -> bool:
         """
         验证密码与哈希是否匹配
-        
+
+        兼容两种格式：
+        - scrypt$salt$hash（当前）
+        - salt:hash（旧版 PBKDF2）
+
         Args:
             password: 待验证的密码
             stored_hash: 存储的哈希
-            
+
         Returns:
             bool: 是否匹配
         """
         try:
-            salt, hash_value = stored_hash.split(':')
-            computed_hash = hashlib.pbkdf2_hmac(
-                'sha256',
-                password.encode('utf-8'),
-                salt.encode('utf-8'),
-                100000
-            ).hex()
+            if stored_hash.startswith("scrypt$"):
+                _, salt, hash_value = stored_hash.split('$')
+                computed_hash = hashlib.scrypt(
+                    password.encode('utf-8'),
+                    salt=salt.encode('utf-8'),
+                    n=2**14, r=8, p=1, dklen=32
+                ).hex()
+            else:
+                # 旧版 PBKDF2 哈希
+                salt, hash_value = stored_hash.split(':')
+                computed_hash = hashlib.pbkdf2_hmac(
+                    'sha256',
+                    password.encode('utf-8'),
+                    salt.encode('utf-8'),
+                    100000
+                ).hex()
             return secrets.compare_digest(hash_value, computed_hash)
         except (ValueError, AttributeError):
             return False
@@ -323,30 +376,39 @@ class AdminAuth:
     def _cleanup_expired_sessions(self):
         """清理过期会话"""
         now = time.time()
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
+        with self._write_lock, self._conn:
+            self._conn.execute(
                 "DELETE FROM admin_sessions WHERE expires_at < ?",
                 (now,)
             )
 
 
+@functools.lru_cache(maxsize=4)
+def _get_user_manager(db_path: str):
+    """按 db_path 缓存 UserManager 实例（构造时会跑一遍建表 DDL）"""
+    # 延迟导入避免循环依赖
+    from users import UserManager
+
+    return UserManager(db_path)
+
+
 def get_current_user_from_env(db_path: str) -> Optional[Dict[str, Any]]:
     """
     从环境变量中的 API Key 获取当前用户
-    
+
+    只缓存管理器构造；行数据查询走 UserManager 的短 TTL 缓存
+    （写路径会主动失效），禁用用户或换 Key 不会被进程内
+    陈旧缓存挡住。
+
     Args:
         db_path: 数据库路径
-        
+
     Returns:
         用户信息字典，如果未配置 API Key 则返回 None
     """
     api_key = os.getenv("USERINTENT_API_KEY")
-    
+
     if not api_key:
         return None
-    
-    # 延迟导入避免循环依赖
-    from users import UserManager
-    
-    manager = UserManager(db_path)
-    return manager.get_user_by_api_key(api_key)
+
+    return _get_user_manager(db_path).get_user_by_api_key(api_key)
@@ -6,11 +6,17 @@ import sys
 import sqlite3
 import base64
 import logging
+import logging.handlers
+import queue
+import subprocess
 import platform
-import uuid
 import time
 import traceback
 import atexit
+import functools
+import reprlib
+from collections import deque
+from itertools import islice
 from typing import Optional, List
 
 from fastmcp import FastMCP
@@ -37,12 +43,11 @@ class State:
 state = State()
 
 # --- Paths ---
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, "data")
-LOG_DIR = os.path.join(BASE_DIR, ".log")
+# BASE_DIR/DATA_DIR/DB_PATH live in paths.py so the standalone WebSocket
+# listener and the main service share one definition
+from paths import BASE_DIR, DATA_DIR, DB_PATH
 
-# Configuration from Environment Variables (MCP Client Config)
-DB_PATH = os.getenv("USERINTENT_DB_PATH", os.path.join(DATA_DIR, "intent.db"))
+LOG_DIR = os.path.join(BASE_DIR, ".log")
 LOG_PATH = os.getenv("USERINTENT_LOG_PATH", os.path.join(LOG_DIR, "intent.log"))
 FATAL_LOG_PATH = os.path.join(LOG_DIR, "fatal.log")
 ENABLE_SYSTEM_NOTIFY = os.getenv("USERINTENT_ENABLE_SYSTEM_NOTIFY", "false").lower() == "true"
@@ -71,8 +76,17 @@ console_handler = logging.StreamHandler()
 console_handler.setFormatter(log_formatter)
 console_handler.setLevel(logging.INFO)
 
+# Route records through a queue so logging calls on the request path just
+# enqueue; the listener thread does the actual file/console writes
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, file_handler, console_handler, respect_handler_level=True
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
 # Configure root logger to INFO to suppress debug noise from libraries
-logging.basicConfig(level=logging.INFO, handlers=[file_handler, console_handler])
+logging.basicConfig(level=logging.INFO, handlers=[logging.handlers.QueueHandler(_log_queue)])
 
 # Set our app's logger to DEBUG
 logger = logging.getLogger("user_intent_mcp")
@@ -86,28 +100,24 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 
 
 # --- Fatal Error Handler ---
-def _extract_exception_group_details(exc, depth=0):
-    """Recursively extract details from ExceptionGroup."""
-    indent = "  " * depth
-    result = []
-    
-    if hasattr(exc, 'exceptions'):
-        result.append(f"{indent}ExceptionGroup: {exc}")
-        for i, nested_exc in enumerate(exc.exceptions):
-            result.append(f"{indent}  [{i+1}] {type(nested_exc).__name__}: {nested_exc}")
-            result.extend(_extract_exception_group_details(nested_exc, depth + 2))
-            if nested_exc.__traceback__:
-                tb_lines = ''.join(traceback.format_exception(type(nested_exc), nested_exc, nested_exc.__traceback__))
-                result.append(f"{indent}  Traceback:\n{tb_lines}")
-    return result
+# Truncating repr - builds the shortened string directly instead of
+# repr'ing a potentially huge object and slicing afterwards
+_frame_repr = reprlib.Repr()
+_frame_repr.maxstring = 200
+_frame_repr.maxother = 200
+
+# Bounds so a deep stack with large locals can't stall the fatal handler
+_MAX_FRAMES = 20
+_MAX_LOCALS_PER_FRAME = 50
 
 
 def _extract_all_frames_locals(exc_traceback):
-    """Extract local variables from all frames in the traceback."""
-    frames_info = []
+    """Extract local variables from the innermost frames of the traceback."""
     if not exc_traceback:
-        return frames_info
-    
+        return []
+
+    # Keep only the innermost _MAX_FRAMES frames (closest to the error)
+    frames_info = deque(maxlen=_MAX_FRAMES)
     tb = exc_traceback
     frame_num = 0
     while tb:
@@ -120,18 +130,26 @@ def _extract_all_frames_locals(exc_traceback):
             'function': frame.f_code.co_name,
             'locals': {}
         }
+        # Bulk path first: repr() almost never raises, so skip per-key
+        # exception handling unless something in this frame actually throws
         try:
-            for key, value in frame.f_locals.items():
-                try:
-                    frame_info['locals'][key] = repr(value)[:200]
-                except Exception:
-                    frame_info['locals'][key] = '<unable to repr>'
+            frame_info['locals'] = {
+                key: _frame_repr.repr(value)
+                for key, value in islice(frame.f_locals.items(), _MAX_LOCALS_PER_FRAME)
+            }
         except Exception:
-            pass
+            try:
+                for key, value in islice(frame.f_locals.items(), _MAX_LOCALS_PER_FRAME):
+                    try:
+                        frame_info['locals'][key] = _frame_repr.repr(value)
+                    except Exception:
+                        frame_info['locals'][key] = '<unable to repr>'
+            except Exception:
+                pass
         frames_info.append(frame_info)
         tb = tb.tb_next
-    
-    return frames_info
+
+    return list(frames_info)
 
 
 def log_fatal_error(exc_type, exc_value, exc_traceback):
@@ -141,7 +159,12 @@ def log_fatal_error(exc_type, exc_value, exc_traceback):
         sys.__excepthook__(exc_type, exc_value, exc_traceback)
         return
     
-    error_msg = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
+    # Single formatting pass: chain=True already walks __cause__/__context__
+    # (and ExceptionGroup children on 3.11+), so no per-link re-stringify
+    te = traceback.TracebackException(
+        exc_type, exc_value, exc_traceback, capture_locals=False
+    )
+    error_msg = ''.join(te.format(chain=True))
     timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
     
     # Collect additional context
@@ -150,41 +173,6 @@ def log_fatal_error(exc_type, exc_value, exc_traceback):
     context_info.append(f"Working Directory: {os.getcwd()}")
     context_info.append(f"Command Line: {' '.join(sys.argv)}")
     
-    # If it's an ExceptionGroup, extract all nested exceptions recursively
-    nested_info = ""
-    if hasattr(exc_value, 'exceptions'):
-        nested_info = "\n--- Nested Exceptions (Recursive) ---\n"
-        nested_details = _extract_exception_group_details(exc_value)
-        nested_info += '\n'.join(nested_details)
-    
-    # Extract chained exceptions (__cause__ and __context__)
-    chain_info = ""
-    current = exc_value
-    chain_depth = 0
-    while current and chain_depth < 10:  # Limit depth to prevent infinite loops
-        if current.__cause__:
-            chain_info += f"\n--- Caused by (depth {chain_depth + 1}) ---\n"
-            chain_info += f"Type: {type(current.__cause__).__name__}\n"
-            chain_info += f"Message: {current.__cause__}\n"
-            if current.__cause__.__traceback__:
-                chain_info += ''.join(traceback.format_exception(
-                    type(current.__cause__), current.__cause__, current.__cause__.__traceback__
-                ))
-            current = current.__cause__
-            chain_depth += 1
-        elif current.__context__ and not current.__suppress_context__:
-            chain_info += f"\n--- Context (depth {chain_depth + 1}) ---\n"
-            chain_info += f"Type: {type(current.__context__).__name__}\n"
-            chain_info += f"Message: {current.__context__}\n"
-            if current.__context__.__traceback__:
-                chain_info += ''.join(traceback.format_exception(
-                    type(current.__context__), current.__context__, current.__context__.__traceback__
-                ))
-            current = current.__context__
-            chain_depth += 1
-        else:
-            break
-    
     # Extract local variables from ALL frames
     local_vars_info = ""
     frames = _extract_all_frames_locals(exc_traceback)
@@ -211,28 +199,27 @@ FATAL ERROR at {timestamp} [PID:{PID}]
 Type: {exc_type.__name__}
 Message: {exc_value}
 
---- Full Traceback ---
+--- Full Traceback (with chained exceptions) ---
 {error_msg}
-{nested_info}
-{chain_info}
 {local_vars_info}
 {'='*60}
 """
     
-    # Write to fatal.log
+    # Write to fatal.log - single O_APPEND write() so the entry lands
+    # atomically with minimal syscalls, no buffering/codec layers
     try:
-        with open(FATAL_LOG_PATH, 'a', encoding='utf-8') as f:
-            f.write(fatal_entry)
+        data = fatal_entry.encode('utf-8')
+        fd = os.open(FATAL_LOG_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
     except Exception:
         pass  # Can't log the logging error
     
     # Also log to regular logger with more detail
     logger.critical(f"FATAL ERROR: {exc_type.__name__}: {exc_value}")
     logger.critical(f"Full traceback:\n{error_msg}")
-    if nested_info:
-        logger.critical(f"Nested exceptions:\n{nested_info}")
-    if chain_info:
-        logger.critical(f"Exception chain:\n{chain_info}")
     logger.critical(f"See {FATAL_LOG_PATH} for full details including local variables")
     
     # Call the original exception hook
@@ -245,8 +232,19 @@ sys.excepthook = log_fatal_error
 
 # --- Exit Handler ---
 def log_exit():
-    """Log process exit."""
-    logger.info(f"Process exiting [PID:{PID}]")
+    """Log process exit with a direct stream write.
+
+    At interpreter shutdown the queue listener may already be stopping, so
+    bypass the queue (and the logging lock) and append straight to the file.
+    """
+    try:
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        file_handler.stream.write(
+            f"{timestamp} - [PID:{PID}] - user_intent_mcp - INFO - Process exiting\n"
+        )
+        file_handler.stream.flush()
+    except Exception:
+        pass  # Stream may already be closed during teardown
 
 
 # Register exit handler
@@ -258,8 +256,8 @@ atexit.register(log_exit)
 def init_db():
     """Initialize the SQLite database."""
     with sqlite3.connect(DB_PATH) as conn:
-        # Create intent_queue table if not exists
-        conn.execute('''
+        # Batched DDL - parsed in one call
+        conn.executescript('''
             CREATE TABLE IF NOT EXISTS intent_queue (
                 id TEXT PRIMARY KEY,
                 question TEXT NOT NULL,
@@ -268,36 +266,60 @@ def init_db():
                 status TEXT DEFAULT 'PENDING',
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 completed_at TIMESTAMP
-            )
-        ''')
-        # Add columns if they don't exist (for migration)
-        try:
-            conn.execute('ALTER TABLE intent_queue ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        try:
-            conn.execute('ALTER TABLE intent_queue ADD COLUMN completed_at TIMESTAMP')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-
-        # Create feishu_config table for persistent configuration storage
-        conn.execute('''
+            );
             CREATE TABLE IF NOT EXISTS feishu_config (
                 key TEXT PRIMARY KEY,
                 value TEXT NOT NULL
-            )
+            );
+        ''')
+
+        # One-time column migrations, gated on user_version so already-
+        # migrated databases skip the ALTERs entirely
+        if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+            try:
+                conn.execute('ALTER TABLE intent_queue ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
+            except sqlite3.OperationalError:
+                pass  # Column already exists
+            try:
+                conn.execute('ALTER TABLE intent_queue ADD COLUMN completed_at TIMESTAMP')
+            except sqlite3.OperationalError:
+                pass  # Column already exists
+            conn.execute("PRAGMA user_version = 1")
+
+        # History cleanup filters on (status, completed_at); without this
+        # index it's a full table scan. Created after the migration so the
+        # column exists on old databases.
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_intent_status_completed
+            ON intent_queue(status, completed_at)
+        ''')
+        # Poll only ever looks at the small live set; a partial index keeps
+        # it an index scan no matter how much history accumulates
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_intent_pending
+            ON intent_queue(id) WHERE status='PENDING'
         ''')
     logger.info(f"Database initialized at {DB_PATH}")
 
 
+# Throttle history cleanup - running it on every completed reply is wasted work
+_CLEANUP_INTERVAL = 10 * 60
+_last_cleanup = 0.0
+
+
 def cleanup_old_history():
-    """Remove history records older than HISTORY_RETENTION_DAYS."""
+    """Remove history records older than HISTORY_RETENTION_DAYS (throttled)."""
+    global _last_cleanup
     if HISTORY_RETENTION_DAYS <= 0:
         return
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute('''
-            DELETE FROM intent_queue 
-            WHERE status = 'COMPLETED' 
+    now = time.monotonic()
+    if now - _last_cleanup < _CLEANUP_INTERVAL:
+        return
+    _last_cleanup = now
+    with _db_lock, _db_conn:
+        _db_conn.execute('''
+            DELETE FROM intent_queue
+            WHERE status = 'COMPLETED'
             AND completed_at < datetime('now', ?)
         ''', (f'-{HISTORY_RETENTION_DAYS} days',))
 
@@ -305,6 +327,26 @@ def cleanup_old_history():
 # Initialize database on import
 init_db()
 
+# Long-lived connection for hot paths (polling loop, user lookups).
+# Opening a connection per query re-reads the file and rebuilds the
+# statement cache; reusing one connection avoids that. Writes are
+# serialized with _db_lock since the connection is shared across threads.
+_db_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+_db_conn.execute("PRAGMA journal_mode=WAL")
+_db_conn.execute("PRAGMA synchronous=NORMAL")
+_db_lock = threading.Lock()
+
+# Hot-path SQL as module constants - the same literal every call, so the
+# connection's compiled-statement cache hits
+_SQL_INSERT_INTENT = (
+    "INSERT INTO intent_queue (id, question, status, user_id) VALUES (?, ?, 'PENDING', ?)"
+)
+_SQL_SELECT_REPLY = "SELECT answer, image, status FROM intent_queue WHERE id = ?"
+_SQL_DELETE_INTENT = "DELETE FROM intent_queue WHERE id = ?"
+_SQL_GET_NOTIFY_SETTING = (
+    "SELECT value FROM user_settings WHERE user_id = ? AND key = 'feishu_notify_enabled'"
+)
+
 
 # --- Notifications ---
 # --- Notifications ---
@@ -315,7 +357,14 @@ def send_notification(title: str, message: str):
         
     try:
         if platform.system() == "Linux":
-            os.system(f'notify-send "{title}" "{message}"')
+            # No shell: avoids the /bin/sh fork and quoting/injection issues
+            subprocess.Popen(
+                ["notify-send", title, message],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
         else:
             notification.notify(title=title, message=message, timeout=10)
     except Exception as e:
@@ -351,7 +400,8 @@ async def collect_user_intent(question: str) -> str | list:
         User's response as text, or a list containing text and image data.
     """
     timeout = DEFAULT_TIMEOUT
-    request_id = str(uuid.uuid4())
+    # Opaque ID; skips the UUID object construction/formatting of uuid4()
+    request_id = os.urandom(16).hex()
     
     # 获取用户信息（用于消息隔离和飞书通知）
     user_info = _get_user_info_from_api_key()
@@ -421,18 +471,9 @@ def _get_api_key() -> str | None:
     return os.getenv("USERINTENT_API_KEY")
 
 
-def _get_user_info_from_api_key() -> dict | None:
-    """
-    获取 API Key 并查询对应的用户信息
-    
-    返回:
-    - 用户信息字典，包含 open_id, name, feishu_notify_enabled 等
-    - 如果未配置或用户不存在，返回 None
-    """
-    api_key = _get_api_key()
-    if not api_key:
-        return None
-    
+@functools.lru_cache(maxsize=8)
+def _lookup_user_info(api_key: str) -> dict | None:
+    """按 API Key 缓存的用户信息查询（见 _get_user_info_from_api_key）"""
     try:
         from users import UserManager
         user_manager = UserManager(DB_PATH)
@@ -441,13 +482,10 @@ def _get_user_info_from_api_key() -> dict | None:
             # 检查用户是否启用了飞书通知
             feishu_notify_enabled = False
             try:
-                with sqlite3.connect(DB_PATH) as conn:
-                    cursor = conn.execute(
-                        "SELECT value FROM user_settings WHERE user_id = ? AND key = 'feishu_notify_enabled'",
-                        (user["open_id"],)
-                    )
-                    row = cursor.fetchone()
-                    feishu_notify_enabled = row[0] == "1" if row else False
+                rows = _db_conn.execute(
+                    _SQL_GET_NOTIFY_SETTING, (user["open_id"],)
+                ).fetchall()
+                feishu_notify_enabled = rows[0][0] == "1" if rows else False
             except Exception:
                 pass  # 表可能不存在
             
@@ -459,10 +497,30 @@ def _get_user_info_from_api_key() -> dict | None:
             }
     except Exception as e:
         logger.warning(f"Failed to get user info from API Key: {e}")
-    
+
     return None
 
 
+def _invalidate_user_cache() -> None:
+    """清空用户信息缓存（用户或通知设置变更后调用）"""
+    _lookup_user_info.cache_clear()
+
+
+def _get_user_info_from_api_key() -> dict | None:
+    """
+    获取 API Key 并查询对应的用户信息（结果按 API Key 缓存）
+
+    返回:
+    - 用户信息字典，包含 open_id, name, feishu_notify_enabled 等
+    - 如果未配置或用户不存在，返回 None
+    """
+    api_key = _get_api_key()
+    if not api_key:
+        return None
+
+    return _lookup_user_info(api_key)
+
+
 def _get_user_id_from_api_key() -> str | None:
     """
     从环境变量获取 API Key 并查询对应的用户 ID（兼容旧接口）
@@ -491,9 +549,10 @@ def _send_feishu_to_user(fs, open_id: str, request_id: str, question: str) -> bo
             return False
         
         # 获取系统配置的 app_id 和 app_secret（从 admin_config 表）
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.execute("SELECT key, value FROM admin_config WHERE key IN ('feishu_app_id', 'feishu_app_secret')")
-            config = {row[0]: row[1] for row in cursor.fetchall()}
+        cursor = _db_conn.execute(
+            "SELECT key, value FROM admin_config WHERE key IN ('feishu_app_id', 'feishu_app_secret')"
+        )
+        config = {row[0]: row[1] for row in cursor.fetchall()}
         
         app_id = config.get('feishu_app_id')
         app_secret = config.get('feishu_app_secret')
@@ -502,13 +561,15 @@ def _send_feishu_to_user(fs, open_id: str, request_id: str, question: str) -> bo
             logger.debug("Feishu app credentials not configured in admin_config")
             return False
         
-        # 临时配置飞书服务以发送消息
-        fs.config.app_id = app_id
-        fs.config.app_secret = app_secret
+        # 配置飞书服务以发送消息；凭证未变时复用已初始化的客户端，
+        # 避免每次发送都重建 HTTP 客户端（丢弃连接池、重新 TLS 握手）
+        if fs._client is None or (fs.config.app_id, fs.config.app_secret) != (app_id, app_secret):
+            fs.config.app_id = app_id
+            fs.config.app_secret = app_secret
+            fs._init_client()
         fs.config.receive_id = open_id
         fs.config.receive_id_type = "open_id"
         fs.config.enabled = True
-        fs._init_client()
         
         # 发送消息
         result = fs.send_message(request_id, question)
@@ -524,81 +585,107 @@ def _get_user_id_from_user_info(user_info: dict | None) -> str | None:
     return user_info["open_id"] if user_info else None
 
 
+# request_id -> (loop, event)：同进程回复写入后直接唤醒等待的协程
+_reply_events: dict[str, tuple] = {}
+
+
+def notify_reply(request_id: str) -> None:
+    """Wake the coroutine waiting in _collect_via_web, if it lives in this process."""
+    entry = _reply_events.get(request_id)
+    if entry:
+        loop, event = entry
+        loop.call_soon_threadsafe(event.set)
+
+
 async def _collect_via_web(request_id: str, question: str, timeout: int) -> str | list:
     """Collect user intent via Web UI (async implementation for SSE mode)."""
     import asyncio
-    
+
     # 获取用户 ID（用于消息隔离）
     user_id = _get_user_id_from_api_key()
-    
+
     # Store question in database（包含 user_id）
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            "INSERT INTO intent_queue (id, question, status, user_id) VALUES (?, ?, 'PENDING', ?)",
-            (request_id, question, user_id)
-        )
+    with _db_lock, _db_conn:
+        _db_conn.execute(_SQL_INSERT_INTENT, (request_id, question, user_id))
+
+    # 注册事件：同进程的回复路径调用 notify_reply 即时唤醒；
+    # 跨进程写入（如 WebSocket 监听子进程）仍由 1 秒兜底轮询覆盖
+    reply_event = asyncio.Event()
+    _reply_events[request_id] = (asyncio.get_running_loop(), reply_event)
     
     logger.info(f"Question stored: {question[:50]}... (ID: {request_id})")
-    # Send System Notification (if enabled)
-    send_notification("AI Intent Request", f"[{request_id[:8]}] {question}")
+    # Send System Notification (if enabled) - off the event loop
+    if ENABLE_SYSTEM_NOTIFY:
+        asyncio.get_running_loop().run_in_executor(
+            None, send_notification, "AI Intent Request", f"[{request_id[:8]}] {question}"
+        )
     
     # Update state for native testing
     state.current_question = question
     state.user_answer = None
     state.answer_event.clear()
     
-    # Poll for response (async to not block event loop)
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        # Native Test Hook: Check if test state was set manually
-        if state.answer_event.is_set():
-            logger.info(f"Native reply detected via state hooks (Test Mode)")
-            res = state.user_answer
-            # Clean up DB for consistency
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.execute("DELETE FROM intent_queue WHERE id = ?", (request_id,))
-            return res
-
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.execute(
-                "SELECT answer, image, status FROM intent_queue WHERE id = ?",
-                (request_id,)
-            )
-            row = cursor.fetchone()
-            
-            if row:
-                answer, image_data, status = row
-                
+    # Wait for response: woken immediately by notify_reply, with a 1s
+    # fallback poll for replies written by other processes
+    try:
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            # Native Test Hook: Check if test state was set manually
+            if state.answer_event.is_set():
+                logger.info(f"Native reply detected via state hooks (Test Mode)")
+                res = state.user_answer
+                # Clean up DB for consistency
+                with _db_lock, _db_conn:
+                    _db_conn.execute(_SQL_DELETE_INTENT, (request_id,))
+                return res
+
+            # fetchall() so the implicit read transaction is released and the
+            # next poll sees writes committed by other processes
+            rows = _db_conn.execute(_SQL_SELECT_REPLY, (request_id,)).fetchall()
+
+            if rows:
+                answer, image_data, status = rows[0]
+
                 if status == 'DISMISSED':
                     # Dismissed records are deleted immediately (not kept in history)
-                    conn.execute("DELETE FROM intent_queue WHERE id = ?", (request_id,))
+                    with _db_lock, _db_conn:
+                        _db_conn.execute(_SQL_DELETE_INTENT, (request_id,))
                     return "User dismissed this request."
-                
+
                 if status == 'COMPLETED' and answer:
                     # Keep completed records for history (cleanup_old_history will remove old ones)
                     logger.info(f"Reply received for {request_id}: text={answer[:30]}..., image={'YES' if image_data else 'NO'}")
                     # Cleanup old history periodically
                     cleanup_old_history()
-                    
+
                     # Return list of content blocks for multimodal response
                     if image_data and image_data.startswith("data:image"):
                         try:
                             header, encoded = image_data.split(",", 1)
                             img_format = header.split("/")[1].split(";")[0]
-                            img_bytes = base64.b64decode(encoded)
+                            # Decode off the event loop - screenshots can be multi-MB
+                            img_bytes = await asyncio.get_running_loop().run_in_executor(
+                                None, base64.b64decode, encoded
+                            )
                             img = Image(data=img_bytes, format=img_format)
                             return [answer, img.to_image_content()]
                         except Exception as e:
                             logger.error(f"Failed to decode image: {e}")
                             return answer
-                    
+
                     return answer
-        
-        # Use asyncio.sleep to yield control back to event loop
-        await asyncio.sleep(1)
-    
-    # Timeout - cleanup
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("DELETE FROM intent_queue WHERE id = ?", (request_id,))
-    
-    return "Timeout: No response received."
+
+            # Block until notified (same-process reply) or 1s fallback tick
+            try:
+                await asyncio.wait_for(reply_event.wait(), timeout=1)
+                reply_event.clear()
+            except asyncio.TimeoutError:
+                pass
+
+        # Timeout - cleanup
+        with _db_lock, _db_conn:
+            _db_conn.execute(_SQL_DELETE_INTENT, (request_id,))
+
+        return "Timeout: No response received."
+    finally:
+        _reply_events.pop(request_id, None)
@@ -0,0 +1,138 @@
+"""
+Shared SQLite connection pool.
+
+Opening a fresh connection per call pays for the file open, default
+pragmas and a cold page cache every time. This module keeps one write
+connection plus a small pool of read connections per database file,
+configured once with WAL so readers never block behind the writer.
+"""
+
+import asyncio
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Read connections per database file
+_POOL_SIZE = os.cpu_count() or 4
+
+# Executor for async handlers: a blocking SQLite call made directly in a
+# coroutine stalls the whole event loop; one extra worker covers writes
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=_POOL_SIZE + 1, thread_name_prefix="db")
+
+
+async def run_db(fn):
+    """Run a blocking database function off the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_DB_EXECUTOR, fn)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _open(db_path: str) -> sqlite3.Connection:
+    """Open one pooled connection with the shared pragma set."""
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class _Pool:
+    """Connections for one database file: one writer, N readers."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # Writer first so the database file exists before we stat it
+        self.writer = _open(db_path)
+        self.writer_lock = threading.Lock()
+        self.readers: queue.Queue = queue.Queue()
+        for _ in range(_POOL_SIZE):
+            self.readers.put(_open(db_path))
+        st = os.stat(db_path)
+        self.file_id = (st.st_dev, st.st_ino)
+
+    def close(self):
+        with contextlib.suppress(Exception):
+            self.writer.close()
+        while True:
+            try:
+                self.readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def _get_pool(db_path: str) -> _Pool:
+    """Return the pool for db_path, rebuilding it if the file was replaced
+    (tests recreate the database between cases)."""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is not None:
+            try:
+                st = os.stat(db_path)
+                if (st.st_dev, st.st_ino) == pool.file_id:
+                    return pool
+            except OSError:
+                pass
+            # The file was removed or swapped out - stale connections
+            # would keep writing to the old inode
+            pool.close()
+        pool = _Pool(db_path)
+        _pools[db_path] = pool
+        return pool
+
+
+def pool_stats() -> dict:
+    """Snapshot of per-database pool usage, for the health endpoint."""
+    with _pools_lock:
+        return {
+            path: {
+                "readers_idle": pool.readers.qsize(),
+                "readers_total": _POOL_SIZE,
+                "writer_busy": pool.writer_lock.locked(),
+            }
+            for path, pool in _pools.items()
+        }
+
+
+def close_all() -> None:
+    """Close every pooled connection (called once at shutdown)."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+@contextlib.contextmanager
+def get_read_conn(db_path: str):
+    """Borrow a read connection from the pool."""
+    pool = _get_pool(db_path)
+    conn = pool.readers.get()
+    try:
+        yield conn
+    finally:
+        pool.readers.put(conn)
+
+
+@contextlib.contextmanager
+def get_write_conn(db_path: str):
+    """Borrow the write connection, wrapping the block in one transaction.
+
+    BEGIN IMMEDIATE takes the write lock up front so the transaction
+    cannot fail with SQLITE_BUSY halfway through.
+    """
+    pool = _get_pool(db_path)
+    with pool.writer_lock:
+        conn = pool.writer
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
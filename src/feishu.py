@@ -14,15 +14,44 @@ import queue
 import time
 from typing import Optional, Callable
 from dataclasses import dataclass, field
+from collections import deque
 
-# Import DB_PATH from core for configuration persistence
-import sys
-import os
-sys.path.insert(0, os.path.dirname(__file__))
-from core import DB_PATH
+# Import DB_PATH from the shared paths module (no sys.path mutation -
+# path hacks at import time invalidate the interpreter's import caches)
+from paths import DB_PATH
 
 logger = logging.getLogger("user_intent_mcp")
 
+# orjson parses short JSON 2-3x faster than stdlib; fall back if absent
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Thread-local connection cache - opening a connection parses the DB header
+# and allocates a page cache each time, which dominates the tiny queries on
+# the reply path. One connection per thread, PRAGMAs applied once.
+_tls = threading.local()
+
+# Message template, JSON-escaped once at import - per send we only escape
+# the question itself and concatenate, skipping the dict + full encode
+_MSG_PREFIX = '{"text":"' + json.dumps("🤖 AI Assistant:\n\n")[1:-1]
+_MSG_SUFFIX = json.dumps("\n\n---\n请直接回复此消息")[1:-1] + '"}'
+
+
+def _get_conn(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """Return this thread's cached SQLite connection, creating it on first use."""
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")  # 8 MiB
+        _tls.conn = conn
+    return conn
+
 # Try to import lark_oapi, but make it optional
 try:
     import lark_oapi as lark
@@ -50,14 +79,10 @@ class FeishuConfig:
     enabled: bool = False
 
 
-@dataclass
-class PendingMessage:
-    """A message waiting for reply."""
-    request_id: str
-    question: str
-    message_id: Optional[str] = None
-    reply: Optional[str] = None
-    replied: bool = False
+# Entries leak if a caller crashes between send and wait; sweep anything
+# older than this once the map grows past the threshold
+_REPLY_QUEUE_TTL = 60 * 60
+_REPLY_QUEUE_SWEEP_THRESHOLD = 1024
 
 
 class FeishuService:
@@ -71,8 +96,14 @@ class FeishuService:
         self.config = FeishuConfig()
         self._client: Optional['lark.Client'] = None
         self._ws_client: Optional['lark.ws.Client'] = None
-        self._pending_messages: dict[str, PendingMessage] = {}
-        self._reply_queues: dict[str, queue.Queue] = {}
+        # request_id -> (created_monotonic, Queue(maxsize=1)); the queue
+        # itself carries the reply, so no separate pending-message
+        # bookkeeping is needed, and the timestamp drives TTL eviction
+        self._reply_queues: dict[str, tuple[float, queue.Queue]] = {}
+        # FIFO of request_ids so reply delivery pops the oldest waiter in
+        # O(1) instead of scanning the dict; stale ids (already cancelled
+        # or replied) are skipped on pop
+        self._pending_order: deque[str] = deque()
         self._lock = threading.Lock()
         self._ws_thread: Optional[threading.Thread] = None
         self._running = False
@@ -96,42 +127,37 @@ class FeishuService:
     def load_config(self) -> None:
         """Load configuration from persistent storage (database)."""
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                # First try to load from feishu_config table
-                cursor = conn.execute(
-                    "SELECT key, value FROM feishu_config"
-                )
-                config_dict = {}
-                for key, value in cursor.fetchall():
-                    config_dict[key] = value
-
-                if config_dict:
-                    self.config.app_id = config_dict.get("app_id", "")
-                    self.config.app_secret = config_dict.get("app_secret", "")
-                    self.config.receive_id = config_dict.get("receive_id", "")
-                    self.config.receive_id_type = config_dict.get("receive_id_type", "open_id")
-                    self.config.enabled = config_dict.get("enabled", "false").lower() == "true"
-
-                    logger.info(f"Loaded Feishu config from feishu_config table: enabled={self.config.enabled}")
-                else:
-                    # Fallback: try to load from admin_config table (used for OAuth)
-                    cursor = conn.execute(
-                        "SELECT key, value FROM admin_config WHERE key IN ('feishu_app_id', 'feishu_app_secret')"
-                    )
-                    admin_config = {row[0]: row[1] for row in cursor.fetchall()}
-                    
-                    if admin_config.get('feishu_app_id') and admin_config.get('feishu_app_secret'):
-                        self.config.app_id = admin_config.get('feishu_app_id', '')
-                        self.config.app_secret = admin_config.get('feishu_app_secret', '')
-                        # Note: receive_id will be set per-user when sending messages
-                        self.config.enabled = True  # Auto-enable if credentials are available
-                        logger.info(f"Loaded Feishu config from admin_config table: app_id={self.config.app_id[:8]}...")
-
-                # Initialize client if configured
-                if self.config.app_id and self.config.app_secret:
-                    self._init_client()
-                    # Note: WebSocket listener should be started separately
-                    # to avoid event loop conflicts in async environments
+            conn = _get_conn()
+            # First try to load from feishu_config table
+            # (dict() consumes the cursor directly, no intermediate list)
+            config_dict = dict(conn.execute("SELECT key, value FROM feishu_config"))
+
+            if config_dict:
+                self.config.app_id = config_dict.get("app_id", "")
+                self.config.app_secret = config_dict.get("app_secret", "")
+                self.config.receive_id = config_dict.get("receive_id", "")
+                self.config.receive_id_type = config_dict.get("receive_id_type", "open_id")
+                self.config.enabled = config_dict.get("enabled", "false").lower() == "true"
+
+                logger.info(f"Loaded Feishu config from feishu_config table: enabled={self.config.enabled}")
+            else:
+                # Fallback: try to load from admin_config table (used for OAuth)
+                admin_config = dict(conn.execute(
+                    "SELECT key, value FROM admin_config WHERE key IN ('feishu_app_id', 'feishu_app_secret')"
+                ))
+
+                if admin_config.get('feishu_app_id') and admin_config.get('feishu_app_secret'):
+                    self.config.app_id = admin_config.get('feishu_app_id', '')
+                    self.config.app_secret = admin_config.get('feishu_app_secret', '')
+                    # Note: receive_id will be set per-user when sending messages
+                    self.config.enabled = True  # Auto-enable if credentials are available
+                    logger.info(f"Loaded Feishu config from admin_config table: app_id={self.config.app_id[:8]}...")
+
+            # Initialize client if configured
+            if self.config.app_id and self.config.app_secret:
+                self._init_client()
+                # Note: WebSocket listener should be started separately
+                # to avoid event loop conflicts in async environments
 
         except sqlite3.OperationalError as e:
             # Table doesn't exist yet, will be created by init_db()
@@ -169,32 +195,27 @@ class FeishuService:
 
         # Save to persistent storage (database)
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                # Use INSERT OR REPLACE to upsert each config value
-                # Always save enabled as string "true" or "false"
-                conn.execute(
-                    "INSERT OR REPLACE INTO feishu_config (key, value) VALUES (?, ?)",
-                    ("app_id", self.config.app_id or "")
-                )
-                conn.execute(
-                    "INSERT OR REPLACE INTO feishu_config (key, value) VALUES (?, ?)",
-                    ("app_secret", self.config.app_secret or "")
-                )
-                conn.execute(
-                    "INSERT OR REPLACE INTO feishu_config (key, value) VALUES (?, ?)",
-                    ("receive_id", self.config.receive_id or "")
-                )
-                conn.execute(
-                    "INSERT OR REPLACE INTO feishu_config (key, value) VALUES (?, ?)",
-                    ("receive_id_type", self.config.receive_id_type or "open_id")
-                )
-                # Explicitly convert enabled to string for storage
-                enabled_str = "true" if self.config.enabled else "false"
-                conn.execute(
+            conn = _get_conn()
+            # Upsert all values in one transaction: one commit/fsync
+            # instead of five separate autocommit boundaries
+            # (enabled is always stored as string "true"/"false")
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
                     "INSERT OR REPLACE INTO feishu_config (key, value) VALUES (?, ?)",
-                    ("enabled", enabled_str)
+                    [
+                        ("app_id", self.config.app_id or ""),
+                        ("app_secret", self.config.app_secret or ""),
+                        ("receive_id", self.config.receive_id or ""),
+                        ("receive_id_type", self.config.receive_id_type or "open_id"),
+                        ("enabled", "true" if self.config.enabled else "false"),
+                    ]
                 )
-                logger.info("Feishu config saved to database")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            logger.info("Feishu config saved to database")
         except Exception as e:
             logger.error(f"Failed to save Feishu config: {e}")
 
@@ -252,15 +273,15 @@ class FeishuService:
             content = message.content
             sender_id = event.sender.sender_id.open_id if event.sender else None
             
-            logger.info(f"Received Feishu message: type={msg_type}, sender={sender_id}")
+            logger.info("Received Feishu message: type=%s, sender=%s", msg_type, sender_id)
             
             # Parse text content
             reply_text = ""
             if msg_type == "text":
                 try:
-                    content_dict = json.loads(content)
+                    content_dict = _loads(content)
                     reply_text = content_dict.get("text", "")
-                except json.JSONDecodeError:
+                except ValueError:
                     reply_text = content
             else:
                 reply_text = f"[{msg_type} message]"
@@ -269,47 +290,47 @@ class FeishuService:
             # and update the database directly
             if sender_id:
                 try:
-                    with sqlite3.connect(DB_PATH) as conn:
-                        # Find pending request for this user
-                        cursor = conn.execute(
-                            """SELECT id FROM intent_queue 
-                               WHERE user_id = ? AND status = 'PENDING' 
-                               ORDER BY created_at ASC LIMIT 1""",
-                            (sender_id,)
+                    conn = _get_conn()
+                    # Find pending request for this user
+                    cursor = conn.execute(
+                        """SELECT id FROM intent_queue
+                           WHERE user_id = ? AND status = 'PENDING'
+                           ORDER BY created_at ASC LIMIT 1""",
+                        (sender_id,)
+                    )
+                    row = cursor.fetchone()
+
+                    if row:
+                        request_id = row[0]
+                        # Update the response in database (使用 answer 字段和 COMPLETED 状态，与 web_multi_tenant.py 保持一致)
+                        conn.execute(
+                            """UPDATE intent_queue
+                               SET answer = ?, status = 'COMPLETED', completed_at = CURRENT_TIMESTAMP
+                               WHERE id = ?""",
+                            (reply_text, request_id)
                         )
-                        row = cursor.fetchone()
-                        
-                        if row:
-                            request_id = row[0]
-                            # Update the response in database (使用 answer 字段和 COMPLETED 状态，与 web_multi_tenant.py 保持一致)
-                            conn.execute(
-                                """UPDATE intent_queue 
-                                   SET answer = ?, status = 'COMPLETED', completed_at = CURRENT_TIMESTAMP
-                                   WHERE id = ?""",
-                                (reply_text, request_id)
-                            )
-                            logger.info(f"Feishu reply stored for user {sender_id[:20]}..., request {request_id}")
-                        else:
-                            logger.warning(f"No pending request found for Feishu user {sender_id[:20]}...")
+                        logger.info("Feishu reply stored for user %.20s..., request %s", sender_id, request_id)
+                    else:
+                        logger.warning("No pending request found for Feishu user %.20s...", sender_id)
                 except Exception as db_error:
-                    logger.error(f"Database error handling Feishu reply: {db_error}")
+                    logger.error("Database error handling Feishu reply: %s", db_error)
             
             # Also deliver to in-memory queues for backward compatibility
             with self._lock:
-                # For simplicity, deliver to the oldest pending message
+                # Deliver to the oldest pending message - pop the FIFO head,
+                # skipping ids that were cancelled or already replied
                 # In production, you might want to track conversation context
-                for request_id, pending in list(self._pending_messages.items()):
-                    if not pending.replied:
-                        pending.reply = reply_text
-                        pending.replied = True
-                        # Signal the waiting queue
-                        if request_id in self._reply_queues:
-                            self._reply_queues[request_id].put(reply_text)
-                        logger.info(f"Delivered reply to request {request_id}: {reply_text[:50]}...")
-                        break
+                while self._pending_order:
+                    request_id = self._pending_order.popleft()
+                    entry = self._reply_queues.get(request_id)
+                    if entry is None or not entry[1].empty():
+                        continue
+                    entry[1].put_nowait(reply_text)
+                    logger.info("Delivered reply to request %s: %.50s...", request_id, reply_text)
+                    break
                         
         except Exception as e:
-            logger.error(f"Error handling Feishu message: {e}")
+            logger.error("Error handling Feishu message: %s", e)
     
     def _start_ws_listener(self):
         """Start WebSocket listener for incoming messages."""
@@ -403,8 +424,8 @@ class FeishuService:
             return {"success": False, "message": "Feishu client not initialized"}
 
         try:
-            # Build message content
-            content = json.dumps({"text": f"🤖 AI Assistant:\n\n{question}\n\n---\n请直接回复此消息"})
+            # Build message content from the pre-escaped template
+            content = _MSG_PREFIX + json.dumps(question, ensure_ascii=False)[1:-1] + _MSG_SUFFIX
 
             # Create request
             request = CreateMessageRequest.builder() \
@@ -428,7 +449,7 @@ class FeishuService:
                 # Try to get more error details from response
                 error_detail = f"code={error_code}, msg={error_msg}"
 
-                logger.error(f"Feishu send failed: {error_detail}")
+                logger.error("Feishu send failed: %s", error_detail)
                 return {
                     "success": False,
                     "message": error_msg,
@@ -437,21 +458,25 @@ class FeishuService:
                 }
 
             message_id = response.data.message_id if response.data else None
-            logger.info(f"Feishu message sent: request_id={request_id}, message_id={message_id}")
+            logger.info("Feishu message sent: request_id=%s, message_id=%s", request_id, message_id)
 
             # Track pending message
             with self._lock:
-                self._pending_messages[request_id] = PendingMessage(
-                    request_id=request_id,
-                    question=question,
-                    message_id=message_id
-                )
-                self._reply_queues[request_id] = queue.Queue()
+                now = time.monotonic()
+                self._reply_queues[request_id] = (now, queue.Queue(maxsize=1))
+                self._pending_order.append(request_id)
+                # Evict abandoned entries so the map stays bounded
+                if len(self._reply_queues) > _REPLY_QUEUE_SWEEP_THRESHOLD:
+                    cutoff = now - _REPLY_QUEUE_TTL
+                    stale = [rid for rid, (created, _) in self._reply_queues.items()
+                             if created < cutoff]
+                    for rid in stale:
+                        del self._reply_queues[rid]
 
             return {"success": True, "message": "Message sent successfully", "message_id": message_id}
 
         except Exception as e:
-            logger.error(f"Feishu send error: {e}")
+            logger.error("Feishu send error: %s", e)
             # Try to extract error code from exception message
             error_msg = str(e)
             error_code = -1
@@ -474,19 +499,18 @@ class FeishuService:
         Returns:
             Reply text or None if timeout
         """
-        if request_id not in self._reply_queues:
+        entry = self._reply_queues.get(request_id)
+        if entry is None:
             return None
-        
+
         try:
-            reply = self._reply_queues[request_id].get(timeout=timeout)
-            return reply
+            return entry[1].get(timeout=timeout)
         except queue.Empty:
-            logger.warning(f"Feishu reply timeout for request {request_id}")
+            logger.warning("Feishu reply timeout for request %s", request_id)
             return None
         finally:
             # Cleanup
             with self._lock:
-                self._pending_messages.pop(request_id, None)
                 self._reply_queues.pop(request_id, None)
     
     def get_reply(self, request_id: str) -> Optional[str]:
@@ -499,14 +523,14 @@ class FeishuService:
         Returns:
             Reply text if available, None otherwise
         """
-        if request_id not in self._reply_queues:
+        entry = self._reply_queues.get(request_id)
+        if entry is None:
             return None
-        
+
         try:
-            reply = self._reply_queues[request_id].get_nowait()
+            reply = entry[1].get_nowait()
             # Cleanup after getting reply
             with self._lock:
-                self._pending_messages.pop(request_id, None)
                 self._reply_queues.pop(request_id, None)
             return reply
         except queue.Empty:
@@ -515,7 +539,6 @@ class FeishuService:
     def cancel_request(self, request_id: str):
         """Cancel a pending request."""
         with self._lock:
-            self._pending_messages.pop(request_id, None)
             self._reply_queues.pop(request_id, None)
 
 
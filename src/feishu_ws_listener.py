@@ -14,17 +14,17 @@ import os
 import sys
 import json
 import time
+import queue
+import random
 import sqlite3
 import logging
 import signal
+import threading
 import multiprocessing
 from typing import Optional, Callable
 
-# 设置路径
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-SRC_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, "data")
-DB_PATH = os.getenv("USERINTENT_DB_PATH", os.path.join(DATA_DIR, "intent.db"))
+# 路径统一由 paths 模块提供，避免与主服务算出不同的 DB_PATH
+from paths import DATA_DIR, DB_PATH
 
 # 配置日志
 logging.basicConfig(
@@ -33,6 +33,59 @@ logging.basicConfig(
 )
 logger = logging.getLogger("feishu_ws_listener")
 
+# orjson 对短 JSON 的解析比标准库快 2-3 倍，未安装则回退
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# 线程本地连接缓存 - 回复风暴时 _store_reply 位于热路径，
+# 每次重新 connect 的开销远超它执行的几条小查询
+_tls = threading.local()
+
+
+def _get_conn(db_path: str) -> sqlite3.Connection:
+    """返回当前线程缓存的数据库连接，首次使用时创建"""
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")  # 8 MiB
+        _tls.conn = conn
+    return conn
+
+
+# 回复批量落盘：最多攒 _FLUSH_MAX_BATCH 条或等 _FLUSH_WINDOW 秒，
+# 一个事务提交整批，把每条消息一次 fsync 摊薄成每批一次
+_FLUSH_MAX_BATCH = 64
+_FLUSH_WINDOW = 0.01
+
+# 重连退避上限（秒）
+_MAX_RECONNECT_DELAY = 60.0
+
+
+def _reconnect_delay(attempt: int) -> float:
+    """指数退避 + 全抖动，避免多实例在同一时刻重连造成风暴"""
+    return random.uniform(0, min(_MAX_RECONNECT_DELAY, 0.5 * (2 ** attempt)))
+
+
+# 模块级 SQL 常量 - 配合缓存连接复用 sqlite3 已编译的语句
+_CRED_SQL = "SELECT key, value FROM admin_config WHERE key IN ('feishu_app_id', 'feishu_app_secret')"
+
+# 单条语句完成"找最早的待处理请求并写入回复"，
+# 避免 SELECT+UPDATE 两次往返以及二者之间的竞争窗口
+_SQL_STORE_REPLY = """
+    UPDATE intent_queue
+    SET answer = ?, status = 'COMPLETED', completed_at = CURRENT_TIMESTAMP
+    WHERE id = (SELECT id FROM intent_queue
+                WHERE user_id = ? AND status = 'PENDING'
+                ORDER BY created_at ASC LIMIT 1)
+    RETURNING id
+"""
+
 # 尝试导入 lark_oapi
 try:
     import lark_oapi as lark
@@ -51,7 +104,23 @@ class FeishuWSListener:
         self.db_path = db_path
         self._running = False
         self._ws_client: Optional[lark.ws.Client] = None
-        
+        self._ensure_index()
+        # 回复先入内存队列，由后台线程批量写库
+        self._reply_buf: queue.SimpleQueue = queue.SimpleQueue()
+        self._flusher = threading.Thread(target=self._flush_replies, daemon=True)
+        self._flusher.start()
+
+    def _ensure_index(self):
+        """确保 _store_reply 的查找走复合索引而非全表扫描"""
+        try:
+            _get_conn(self.db_path).execute(
+                """CREATE INDEX IF NOT EXISTS idx_intent_queue_user_status_created
+                   ON intent_queue(user_id, status, created_at)"""
+            )
+        except sqlite3.OperationalError as e:
+            # intent_queue 尚未建表时跳过，由主服务的 init_db() 负责
+            logger.debug(f"Index creation skipped: {e}")
+
     def _handle_message_receive(self, data) -> None:
         """处理接收到的消息事件"""
         try:
@@ -63,56 +132,77 @@ class FeishuWSListener:
             content = message.content
             sender_id = event.sender.sender_id.open_id if event.sender else None
             
-            logger.info(f"Received Feishu message: type={msg_type}, sender={sender_id[:20] if sender_id else 'unknown'}...")
+            logger.info("Received Feishu message: type=%s, sender=%.20s...", msg_type, sender_id or 'unknown')
             
             # 解析文本内容
             reply_text = ""
             if msg_type == "text":
                 try:
-                    content_dict = json.loads(content)
+                    content_dict = _loads(content)
                     reply_text = content_dict.get("text", "")
-                except json.JSONDecodeError:
+                except ValueError:
                     reply_text = content
             else:
                 reply_text = f"[{msg_type} message]"
             
-            # 将回复写入数据库
+            # 回复入队，由批量落盘线程写库
             if sender_id:
-                self._store_reply(sender_id, reply_text)
+                self._reply_buf.put((sender_id, reply_text))
                 
         except Exception as e:
-            logger.error(f"Error handling Feishu message: {e}")
+            logger.error("Error handling Feishu message: %s", e)
     
+    def _flush_replies(self):
+        """后台线程：攒批后在单个事务内写入全部回复"""
+        while True:
+            batch = [self._reply_buf.get()]
+            deadline = time.monotonic() + _FLUSH_WINDOW
+            while len(batch) < _FLUSH_MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._reply_buf.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._store_replies(batch)
+
+    def _store_replies(self, batch: list) -> None:
+        """单个事务写入一批回复，每批只提交一次"""
+        try:
+            conn = _get_conn(self.db_path)
+            conn.execute("BEGIN")
+            try:
+                for sender_id, reply_text in batch:
+                    row = conn.execute(_SQL_STORE_REPLY, (reply_text, sender_id)).fetchone()
+                    if row:
+                        logger.info("Reply stored for user %.20s..., request %s", sender_id, row[0])
+                    else:
+                        logger.warning("No pending request found for Feishu user %.20s...", sender_id)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            logger.error("Database error storing replies: %s", e)
+
     def _store_reply(self, sender_id: str, reply_text: str) -> bool:
         """将回复存储到数据库"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                # 查找该用户的待处理请求
-                cursor = conn.execute(
-                    """SELECT id FROM intent_queue 
-                       WHERE user_id = ? AND status = 'PENDING' 
-                       ORDER BY created_at ASC LIMIT 1""",
-                    (sender_id,)
-                )
-                row = cursor.fetchone()
-                
-                if row:
-                    request_id = row[0]
-                    # 更新数据库中的响应（使用 answer 字段和 COMPLETED 状态，与 web_multi_tenant.py 保持一致）
-                    conn.execute(
-                        """UPDATE intent_queue 
-                           SET answer = ?, status = 'COMPLETED', completed_at = CURRENT_TIMESTAMP
-                           WHERE id = ?""",
-                        (reply_text, request_id)
-                    )
-                    logger.info(f"Reply stored for user {sender_id[:20]}..., request {request_id}")
-                    return True
-                else:
-                    logger.warning(f"No pending request found for Feishu user {sender_id[:20]}...")
-                    return False
-                    
+            conn = _get_conn(self.db_path)
+            # 更新该用户最早的待处理请求（使用 answer 字段和 COMPLETED 状态，与 web_multi_tenant.py 保持一致）
+            row = conn.execute(_SQL_STORE_REPLY, (reply_text, sender_id)).fetchone()
+
+            if row:
+                logger.info("Reply stored for user %.20s..., request %s", sender_id, row[0])
+                return True
+            else:
+                logger.warning("No pending request found for Feishu user %.20s...", sender_id)
+                return False
+
+
         except Exception as e:
-            logger.error(f"Database error storing reply: {e}")
+            logger.error("Database error storing reply: %s", e)
             return False
     
     def start(self):
@@ -152,24 +242,40 @@ class FeishuWSListener:
             logger.info("Feishu WebSocket listener stopped")
     
     def stop(self):
-        """停止 WebSocket 监听"""
+        """停止 WebSocket 监听（尽力断开当前连接，让 start() 返回）"""
         self._running = False
+        client = self._ws_client
+        if client is not None:
+            # 不同版本 SDK 暴露的关闭入口不一样，逐个尝试；
+            # 都不可用时连接保持原样，由调用方走整进程重启兜底
+            for name in ("stop", "close", "disconnect", "_disconnect"):
+                fn = getattr(client, name, None)
+                if not callable(fn):
+                    continue
+                try:
+                    result = fn()
+                    if hasattr(result, "close"):
+                        # 拿到的是协程对象（async 关闭入口），这里没有
+                        # 它的事件循环可调度，关掉协程继续试下一个
+                        result.close()
+                        continue
+                    break
+                except Exception as e:
+                    logger.debug(f"WebSocket teardown via {name} failed: {e}")
         logger.info("Stop requested")
 
 
 def get_feishu_credentials(db_path: str) -> tuple[Optional[str], Optional[str]]:
     """从数据库获取飞书凭证"""
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.execute(
-                "SELECT key, value FROM admin_config WHERE key IN ('feishu_app_id', 'feishu_app_secret')"
-            )
-            config = {row[0]: row[1] for row in cursor.fetchall()}
-            
-            app_id = config.get('feishu_app_id')
-            app_secret = config.get('feishu_app_secret')
-            
-            return app_id, app_secret
+        conn = _get_conn(db_path)
+        # dict() 直接消费游标，省去 fetchall() 的中间列表
+        config = dict(conn.execute(_CRED_SQL))
+
+        app_id = config.get('feishu_app_id')
+        app_secret = config.get('feishu_app_secret')
+
+        return app_id, app_secret
     except Exception as e:
         logger.error(f"Error reading credentials from database: {e}")
         return None, None
@@ -180,10 +286,93 @@ def get_credentials_hash(db_path: str) -> str:
     import hashlib
     app_id, app_secret = get_feishu_credentials(db_path)
     if app_id and app_secret:
-        return hashlib.md5(f"{app_id}:{app_secret}".encode()).hexdigest()
+        # blake2b 对短输入比 MD5 更快，8 字节摘要足以检测变化
+        return hashlib.blake2b(
+            f"{app_id}:{app_secret}".encode(), digest_size=8
+        ).hexdigest()
     return ""
 
 
+def _run_listener_entry(app_id: str, app_secret: str, db_path: str,
+                        pipe: Optional["multiprocessing.connection.Connection"] = None):
+    """子进程入口：运行监听器并支持管道下发的凭证热更新
+
+    顶层函数以便 spawn 启动方式直接 pickle 引用，
+    子进程只加载本模块及其依赖，不继承父进程状态。
+    """
+    if not LARK_AVAILABLE:
+        logger.error("lark_oapi not available, cannot start WebSocket listener")
+        return
+
+    # listener 会随凭证更新被替换，用单元素列表让读管道线程
+    # 和信号处理器始终拿到当前实例
+    current = [FeishuWSListener(app_id, app_secret, db_path)]
+    # 新凭证先入队，由主循环在连接断开后取用
+    creds_box: queue.SimpleQueue = queue.SimpleQueue()
+
+    # 处理信号
+    def signal_handler(signum, frame):
+        current[0].stop()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    if pipe is not None:
+        def _pipe_reader():
+            """常驻线程：收到新凭证立即拆掉当前长连接触发重连。
+
+            start() 阻塞在健康的连接上时不会回到主循环，
+            只靠断线间隙轮询管道会让新凭证一直不生效。
+            """
+            while True:
+                try:
+                    msg = pipe.recv()
+                except (EOFError, OSError):
+                    return
+                creds_box.put(msg)
+                current[0].stop()
+
+        threading.Thread(target=_pipe_reader, daemon=True).start()
+
+    # 持续运行，断线重连（指数退避）
+    attempt = 0
+    while True:
+        connected_at = time.monotonic()
+        try:
+            current[0].start()
+        except Exception as e:
+            logger.error(f"Listener error: {e}")
+
+        # 连接维持过 30 秒说明上次连接成功，重置退避计数
+        if time.monotonic() - connected_at > 30:
+            attempt = 0
+
+        # 应用管道下发的新凭证（只取最新一条），并向管理器回执，
+        # 管理器收不到回执会回退整进程重启
+        new_creds = None
+        while True:
+            try:
+                new_creds = creds_box.get_nowait()
+            except queue.Empty:
+                break
+        if new_creds is not None:
+            new_id, new_secret = new_creds
+            current[0] = FeishuWSListener(new_id, new_secret, db_path)
+            logger.info(f"Credentials updated, reconnecting with app_id={new_id[:8]}...")
+            try:
+                pipe.send("applied")
+            except (OSError, BrokenPipeError):
+                pass
+            attempt = 0
+            continue
+
+        delay = _reconnect_delay(attempt)
+        attempt += 1
+        logger.info(f"Reconnecting in {delay:.1f} seconds...")
+        time.sleep(delay)
+
+
 class FeishuWSManager:
     """飞书 WebSocket 进程管理器
     
@@ -195,35 +384,10 @@ class FeishuWSManager:
     def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
         self._process: Optional[multiprocessing.Process] = None
+        self._pipe: Optional[multiprocessing.connection.Connection] = None
         self._credentials_hash: str = ""
         self._monitor_running = False
-        
-    def _run_listener(self, app_id: str, app_secret: str, db_path: str):
-        """在子进程中运行监听器"""
-        if not LARK_AVAILABLE:
-            logger.error("lark_oapi not available, cannot start WebSocket listener")
-            return
-            
-        listener = FeishuWSListener(app_id, app_secret, db_path)
-        
-        # 处理信号
-        def signal_handler(signum, frame):
-            listener.stop()
-            sys.exit(0)
-        
-        signal.signal(signal.SIGINT, signal_handler)
-        signal.signal(signal.SIGTERM, signal_handler)
-        
-        # 持续运行，断线重连
-        while True:
-            try:
-                listener.start()
-            except Exception as e:
-                logger.error(f"Listener error: {e}")
-            
-            logger.info("Reconnecting in 5 seconds...")
-            time.sleep(5)
-    
+
     def start(self) -> bool:
         """启动 WebSocket 监听子进程"""
         if not LARK_AVAILABLE:
@@ -245,12 +409,17 @@ class FeishuWSManager:
         logger.info(f"Starting Feishu WebSocket listener subprocess...")
         logger.info(f"App ID: {app_id[:8]}...")
         
-        self._process = multiprocessing.Process(
-            target=self._run_listener,
-            args=(app_id, app_secret, self.db_path),
+        # spawn 启动：子进程只导入本模块所需依赖，
+        # 不复制父进程内存映像，也避免 fork 后 SQLite/SSL 状态问题
+        ctx = multiprocessing.get_context("spawn")
+        self._pipe, child_pipe = ctx.Pipe()
+        self._process = ctx.Process(
+            target=_run_listener_entry,
+            args=(app_id, app_secret, self.db_path, child_pipe),
             daemon=True
         )
         self._process.start()
+        child_pipe.close()
         
         logger.info(f"WebSocket listener subprocess started with PID: {self._process.pid}")
         return True
@@ -266,9 +435,28 @@ class FeishuWSManager:
                 self._process.kill()
             logger.info("WebSocket listener subprocess stopped")
         self._process = None
-    
+        if self._pipe is not None:
+            self._pipe.close()
+            self._pipe = None
+
     def restart(self):
-        """重启 WebSocket 监听子进程"""
+        """重启 WebSocket 监听（凭证变化时优先进程内热更新）"""
+        # 子进程还活着就通过管道下发新凭证，免掉解释器重启的开销；
+        # 必须等子进程回执确认旧连接已拆掉，否则（比如 SDK 没有可用的
+        # 关闭入口、旧连接还健康地挂着）回退整进程重启
+        if self._process and self._process.is_alive() and self._pipe is not None:
+            app_id, app_secret = get_feishu_credentials(self.db_path)
+            if app_id and app_secret:
+                logger.info("Sending new credentials to listener subprocess...")
+                try:
+                    self._pipe.send((app_id, app_secret))
+                    if self._pipe.poll(3) and self._pipe.recv() == "applied":
+                        self._credentials_hash = get_credentials_hash(self.db_path)
+                        return True
+                except (EOFError, OSError, BrokenPipeError) as e:
+                    logger.warning(f"Pipe hot-update failed: {e}")
+                logger.info("Hot update not confirmed, falling back to full restart")
+
         logger.info("Restarting WebSocket listener...")
         self.stop()
         time.sleep(1)  # 短暂等待
@@ -351,16 +539,23 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
-    # 启动监听
+    # 启动监听（指数退避重连）
+    attempt = 0
     while True:
+        connected_at = time.monotonic()
         try:
             listener.start()
         except Exception as e:
             logger.error(f"Listener error: {e}")
-        
+
+        if time.monotonic() - connected_at > 30:
+            attempt = 0
+
         if not listener._running:
-            logger.info("Reconnecting in 5 seconds...")
-            time.sleep(5)
+            delay = _reconnect_delay(attempt)
+            attempt += 1
+            logger.info(f"Reconnecting in {delay:.1f} seconds...")
+            time.sleep(delay)
 
 
 if __name__ == "__main__":
@@ -2,10 +2,79 @@
 飞书 OAuth 模块 - 处理 OAuth 2.0 授权流程
 """
 
+import json as _json
+import os
 import secrets
 import time
 import urllib.parse
 from typing import Optional, Dict, Any, Tuple
+from collections import OrderedDict
+
+
+class _MemoryStateStore:
+    """进程内 state 存储（默认实现）
+
+    TTL 相同所以插入序即过期序，清理只需从队首弹出；
+    仅适用于单进程部署。
+    """
+
+    def __init__(self):
+        self._states: OrderedDict[str, float] = OrderedDict()
+        # 清理节流时间戳
+        self._last_cleanup: float = 0
+
+    def set(self, state: str, expires_at: float) -> None:
+        self._states[state] = expires_at
+
+    def pop_if_valid(self, state: str) -> bool:
+        now = time.time()
+        # 清理节流：最多每秒扫一次（新生成的 state 不可能已过期）
+        if now - self._last_cleanup > 1:
+            self._cleanup(now)
+            self._last_cleanup = now
+
+        # 取出即删除，防止重放攻击
+        expires_at = self._states.pop(state, None)
+        return expires_at is not None and now <= expires_at
+
+    def _cleanup(self, now: float) -> None:
+        """清理过期的 state（只触碰实际过期的队首条目）"""
+        while self._states:
+            _, expires_at = next(iter(self._states.items()))
+            if expires_at > now:
+                break
+            self._states.popitem(last=False)
+
+
+class RedisStateStore:
+    """Redis 版 state 存储
+
+    多 worker 部署（uvicorn --workers N）时各进程共享 state，
+    过期由 Redis TTL 负责，无需本地扫描。
+    """
+
+    def __init__(self, url: str):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+
+    def set(self, state: str, expires_at: float) -> None:
+        self._redis.set(f"oauth_state:{state}", 1, exat=int(expires_at))
+
+    def pop_if_valid(self, state: str) -> bool:
+        # GETDEL 原子地取出并删除
+        return self._redis.getdel(f"oauth_state:{state}") is not None
+
+
+def _default_state_store():
+    """按配置选择 state 存储：设置了 USERINTENT_REDIS_URL 且装有
+    redis 时用共享存储，否则回退进程内字典"""
+    redis_url = os.getenv("USERINTENT_REDIS_URL")
+    if redis_url:
+        try:
+            return RedisStateStore(redis_url)
+        except ImportError:
+            pass
+    return _MemoryStateStore()
 
 
 class FeishuOAuth:
@@ -25,7 +94,8 @@ class FeishuOAuth:
         self,
         app_id: str,
         app_secret: str,
-        redirect_uri: str
+        redirect_uri: str,
+        state_store=None
     ):
         """
         初始化飞书 OAuth
@@ -34,17 +104,33 @@ class FeishuOAuth:
             app_id: 飞书应用 App ID
             app_secret: 飞书应用 App Secret
             redirect_uri: OAuth 回调地址
+            state_store: 可选的 state 存储（默认按环境自动选择）
         """
         self.app_id = app_id
         self.app_secret = app_secret
         self.redirect_uri = redirect_uri
         
-        # 存储有效的 state（用于防止 CSRF）
-        self._valid_states: Dict[str, float] = {}
+        # state 存储（用于防止 CSRF）
+        self._state_store = state_store if state_store is not None else _default_state_store()
         
         # 缓存 app_access_token
         self._app_access_token: Optional[str] = None
         self._app_token_expires_at: float = 0
+
+        # 预序列化的请求体/请求头：app_id/app_secret 不变，
+        # 没必要每次请求都 json.dumps 一遍；Bearer 头只在 token 轮换时重建
+        self._app_token_body_json: bytes = _json.dumps({
+            "app_id": app_id,
+            "app_secret": app_secret
+        }).encode()
+        self._bearer_header: Dict[str, str] = {}
+
+        # 长连接 HTTP 客户端（惰性创建）- keepalive 复用连接，
+        # 省去每次请求到飞书的 TCP+TLS 握手
+        self._client = None
+
+        # token 刷新锁（惰性创建，避免构造时绑定事件循环）
+        self._token_lock = None
     
     def get_authorize_url(self, scope: str = "contact:user.base:readonly") -> Tuple[str, str]:
         """
@@ -80,14 +166,7 @@ class FeishuOAuth:
         Returns:
             bool: state 是否有效
         """
-        self._cleanup_expired_states()
-        
-        if state not in self._valid_states:
-            return False
-        
-        # 验证后删除，防止重放攻击
-        del self._valid_states[state]
-        return True
+        return self._state_store.pop_if_valid(state)
     
     async def get_app_access_token(self) -> str:
         """
@@ -96,29 +175,36 @@ class FeishuOAuth:
         Returns:
             str: app_access_token
         """
-        # 检查缓存
+        # 快路径：缓存有效时不加锁直接返回
         if self._app_access_token and time.time() < self._app_token_expires_at:
             return self._app_access_token
-        
-        response = await self._request(
-            "POST",
-            self.APP_ACCESS_TOKEN_URL,
-            json={
-                "app_id": self.app_id,
-                "app_secret": self.app_secret
-            }
-        )
-        
-        if response.get("code") != 0:
-            raise OAuthError(
-                f"获取 app_access_token 失败: {response.get('msg')}"
+
+        if self._token_lock is None:
+            import asyncio
+            self._token_lock = asyncio.Lock()
+
+        # 双重检查加锁：token 过期瞬间的并发调用只触发一次刷新
+        async with self._token_lock:
+            if self._app_access_token and time.time() < self._app_token_expires_at:
+                return self._app_access_token
+
+            response = await self._request(
+                "POST",
+                self.APP_ACCESS_TOKEN_URL,
+                content=self._app_token_body_json
             )
-        
-        self._app_access_token = response.get("app_access_token")
-        # 提前5分钟过期
-        self._app_token_expires_at = time.time() + response.get("expire", 7200) - 300
-        
-        return self._app_access_token
+
+            if response.get("code") != 0:
+                raise OAuthError(
+                    f"获取 app_access_token 失败: {response.get('msg')}"
+                )
+
+            self._app_access_token = response.get("app_access_token")
+            self._bearer_header = {"Authorization": f"Bearer {self._app_access_token}"}
+            # 提前5分钟过期
+            self._app_token_expires_at = time.time() + response.get("expire", 7200) - 300
+
+            return self._app_access_token
     
     async def exchange_code(self, code: str) -> Dict[str, Any]:
         """
@@ -130,12 +216,12 @@ class FeishuOAuth:
         Returns:
             Dict: 包含 access_token, refresh_token 等的字典
         """
-        app_token = await self.get_app_access_token()
-        
+        await self.get_app_access_token()
+
         response = await self._request(
             "POST",
             self.TOKEN_URL,
-            headers={"Authorization": f"Bearer {app_token}"},
+            headers=self._bearer_header,
             json={
                 "grant_type": "authorization_code",
                 "code": code
@@ -159,12 +245,12 @@ class FeishuOAuth:
         Returns:
             Dict: 包含新的 access_token, refresh_token 等的字典
         """
-        app_token = await self.get_app_access_token()
-        
+        await self.get_app_access_token()
+
         response = await self._request(
             "POST",
             self.REFRESH_TOKEN_URL,
-            headers={"Authorization": f"Bearer {app_token}"},
+            headers=self._bearer_header,
             json={
                 "grant_type": "refresh_token",
                 "refresh_token": refresh_token
@@ -206,7 +292,8 @@ class FeishuOAuth:
         method: str,
         url: str,
         headers: Optional[Dict[str, str]] = None,
-        json: Optional[Dict[str, Any]] = None
+        json: Optional[Dict[str, Any]] = None,
+        content: Optional[bytes] = None
     ) -> Dict[str, Any]:
         """
         发送 HTTP 请求
@@ -216,46 +303,49 @@ class FeishuOAuth:
             url: 请求 URL
             headers: 请求头
             json: JSON 请求体
+            content: 预序列化的 JSON 字节（与 json 二选一）
             
         Returns:
             Dict: 响应 JSON
         """
         import httpx
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=json,
-                timeout=30
+
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=30,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
             )
-            
-            return response.json()
+
+        if content is not None:
+            headers = {**(headers or {}), "Content-Type": "application/json"}
+
+        response = await self._client.request(
+            method=method,
+            url=url,
+            headers=headers,
+            json=json,
+            content=content
+        )
+
+        return response.json()
+
+    async def aclose(self):
+        """关闭 HTTP 客户端（应用关闭时调用）"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
     def _generate_state(self) -> str:
         """
         生成 OAuth state 参数
-        
+
         Returns:
-            str: 32字符的随机字符串
+            str: 22字符的随机字符串（128 位熵，URL 安全无需转义）
         """
-        state = secrets.token_hex(16)
-        self._valid_states[state] = time.time() + self.STATE_EXPIRY
-        
-        self._cleanup_expired_states()
-        
+        state = secrets.token_urlsafe(16)
+        self._state_store.set(state, time.time() + self.STATE_EXPIRY)
+
         return state
-    
-    def _cleanup_expired_states(self):
-        """清理过期的 state"""
-        now = time.time()
-        expired = [
-            state for state, expires_at in self._valid_states.items()
-            if now > expires_at
-        ]
-        for state in expired:
-            del self._valid_states[state]
 
 
 class OAuthError(Exception):
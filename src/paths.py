@@ -0,0 +1,12 @@
+"""
+Shared filesystem paths - single source of truth for the database location.
+
+Both the main service (core) and the standalone WebSocket listener import
+from here, so they can never disagree on where the data lives.
+"""
+import os
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+DB_PATH = os.getenv("USERINTENT_DB_PATH", os.path.join(DATA_DIR, "intent.db"))
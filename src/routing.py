@@ -2,70 +2,119 @@
 消息路由模块 - 处理消息的发送和接收路由
 """
 
+import asyncio
 import sqlite3
+from functools import cached_property
+import threading
 import time
 from typing import Optional, Dict, Any, List
 import logging
 
 logger = logging.getLogger("user_intent_mcp.routing")
 
+# 发送合并：攒 ~50ms 内的消息并发发出，
+# 把 N 次串行 HTTPS 往返变成一批并行请求
+_SEND_BATCH_WINDOW = 0.05
+_SEND_BATCH_MAX = 32
+
+# api_key -> (过期时刻, 用户信息)。同一个 Key 会连续触发多次发送，
+# 短 TTL 缓存省掉每条消息一次 SQLite 查询
+_api_key_cache: Dict[str, tuple] = {}
+_API_KEY_CACHE_TTL = 60
+
+# SQL 常量：文本完全一致才能命中 sqlite3 的语句缓存，
+# 单条插入与批量插入复用同一条预编译语句
+_SQL_INSERT_PENDING = '''
+    INSERT INTO intent_queue
+    (id, question, status, open_id, api_key, created_at)
+    VALUES (?, ?, 'PENDING', ?, ?, CURRENT_TIMESTAMP)
+'''
+
 
 class MessageRouter:
     """消息路由器"""
     
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # 线程本地连接缓存 - 每次重新 connect 要解析 schema、
+        # 跑默认 PRAGMA、抢文件锁，开销远超单条小查询
+        self._tls = threading.local()
         self._init_db()
         
-        # 飞书服务实例（延迟加载）
-        self._feishu_service = None
+        # 发送合并队列与后台任务（惰性创建，避免构造时绑定事件循环）
+        self._send_queue: Optional[asyncio.Queue] = None
+        self._send_worker: Optional[asyncio.Task] = None
+
+    @cached_property
+    def _feishu_service(self):
+        """飞书服务实例（首次访问时解析，之后为普通属性读取）"""
+        from feishu import feishu_service
+        return feishu_service
+
+    def _conn(self) -> sqlite3.Connection:
+        """返回当前线程缓存的数据库连接，首次使用时创建"""
+        conn = getattr(self._tls, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path, check_same_thread=False, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._tls.conn = conn
+        return conn
     
     def _init_db(self):
         """初始化数据库表"""
-        with sqlite3.connect(self.db_path) as conn:
-            # 扩展 intent_queue 表，添加用户关联
-            # 先检查表是否存在
-            cursor = conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name='intent_queue'"
-            )
-            
-            if cursor.fetchone():
-                # 表已存在，尝试添加新列
-                try:
-                    conn.execute("ALTER TABLE intent_queue ADD COLUMN open_id TEXT")
-                except sqlite3.OperationalError:
-                    pass  # 列已存在
-                
-                try:
-                    conn.execute("ALTER TABLE intent_queue ADD COLUMN api_key TEXT")
-                except sqlite3.OperationalError:
-                    pass  # 列已存在
-            else:
-                # 创建新表（包含所有字段）
-                conn.execute('''
-                    CREATE TABLE intent_queue (
-                        id TEXT PRIMARY KEY,
-                        question TEXT NOT NULL,
-                        answer TEXT,
-                        image TEXT,
-                        status TEXT DEFAULT 'PENDING',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        completed_at TIMESTAMP,
-                        open_id TEXT,
-                        api_key TEXT
-                    )
-                ''')
-            
-            # 创建索引
-            conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_intent_queue_open_id 
-                ON intent_queue(open_id)
-            ''')
+        conn = self._conn()
+        # 扩展 intent_queue 表，添加用户关联
+        # 先检查表是否存在
+        cursor = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='intent_queue'"
+        )
+
+        if cursor.fetchone():
+            # 表已存在，只补真正缺失的列 - 先读 table_info 一次，
+            # 免得每次启动都盲目发 ALTER 再靠异常兜底
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(intent_queue)")}
+            if 'open_id' not in cols:
+                conn.execute("ALTER TABLE intent_queue ADD COLUMN open_id TEXT")
+            if 'api_key' not in cols:
+                conn.execute("ALTER TABLE intent_queue ADD COLUMN api_key TEXT")
+        else:
+            # 创建新表（包含所有字段）
             conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_intent_queue_status 
-                ON intent_queue(status)
+                CREATE TABLE intent_queue (
+                    id TEXT PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    answer TEXT,
+                    image TEXT,
+                    status TEXT DEFAULT 'PENDING',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    completed_at TIMESTAMP,
+                    open_id TEXT,
+                    api_key TEXT
+                )
             ''')
-    
+
+        # 创建索引 - "找某用户最早的待处理请求"走复合索引一次定位，
+        # 免去按单列过滤后再排序；单列 open_id 索引已被它覆盖
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_intent_queue_user_status_time
+            ON intent_queue(open_id, status, created_at)
+        ''')
+        conn.execute("DROP INDEX IF EXISTS idx_intent_queue_open_id")
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_intent_queue_status
+            ON intent_queue(status)
+        ''')
+        # 部分索引只收录已完成的行，让按期限清理的 DELETE
+        # 随待删行数而非全表行数伸缩
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_intent_queue_status_completed
+            ON intent_queue(status, completed_at) WHERE status='COMPLETED'
+        ''')
+
     def create_pending_request(
         self,
         request_id: str,
@@ -86,19 +135,53 @@ class MessageRouter:
             bool: 是否创建成功
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute('''
-                    INSERT INTO intent_queue 
-                    (id, question, status, open_id, api_key, created_at)
-                    VALUES (?, ?, 'PENDING', ?, ?, CURRENT_TIMESTAMP)
-                ''', (request_id, question, open_id, api_key))
-            
+            self._conn().execute(
+                _SQL_INSERT_PENDING, (request_id, question, open_id, api_key)
+            )
+
             logger.info(f"Created pending request {request_id} for user {open_id}")
             return True
             
         except sqlite3.IntegrityError:
             logger.warning(f"Request {request_id} already exists")
             return False
+
+    def create_pending_requests_bulk(
+        self,
+        rows: List[tuple]
+    ) -> bool:
+        """
+        批量创建待处理的请求
+
+        一次事务 + executemany 写入整批，fsync 和语句准备
+        的开销按批摊销，而不是每条请求付一次。
+
+        Args:
+            rows: (request_id, question, open_id, api_key) 元组列表
+
+        Returns:
+            bool: 是否全部创建成功
+        """
+        if not rows:
+            return True
+
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(_SQL_INSERT_PENDING, rows)
+            conn.execute("COMMIT")
+        except sqlite3.IntegrityError:
+            conn.execute("ROLLBACK")
+            logger.warning("Bulk create aborted: duplicate request id")
+            return False
+        except BaseException:
+            # 连接是线程缓存的自动提交连接，任何异常都必须回滚，
+            # 否则悬着的事务会吞掉该线程之后的所有写入
+            conn.execute("ROLLBACK")
+            raise
+
+        logger.info(f"Created {len(rows)} pending requests in bulk")
+        return True
     
     def get_pending_requests(
         self,
@@ -115,30 +198,23 @@ class MessageRouter:
         Returns:
             待处理请求列表
         """
-        query = "SELECT * FROM intent_queue WHERE status = 'PENDING'"
+        # 只取用到的 4 列，按元组位置直接建字典，避免 Row 对象中转
+        query = ("SELECT id, question, open_id, created_at FROM intent_queue "
+                 "WHERE status = 'PENDING'")
         params = []
-        
+
         if open_id:
             query += " AND open_id = ?"
             params.append(open_id)
-        
+
         query += " ORDER BY created_at ASC LIMIT ?"
         params.append(limit)
-        
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.execute(query, params)
-            
-            results = []
-            for row in cursor.fetchall():
-                results.append({
-                    "request_id": row["id"],
-                    "question": row["question"],
-                    "open_id": row["open_id"],
-                    "created_at": row["created_at"]
-                })
-            
-            return results
+
+        cursor = self._conn().execute(query, params)
+        return [
+            {"request_id": r[0], "question": r[1], "open_id": r[2], "created_at": r[3]}
+            for r in cursor
+        ]
     
     async def send_to_user(
         self,
@@ -157,7 +233,7 @@ class MessageRouter:
         Returns:
             bool: 是否发送成功
         """
-        return await self._send_feishu_message(open_id, message, request_id)
+        return await self._enqueue_send(open_id, message, request_id)
     
     async def send_by_api_key(
         self,
@@ -176,21 +252,73 @@ class MessageRouter:
         Returns:
             bool: 是否发送成功
         """
-        from users import UserManager
-        
-        manager = UserManager(self.db_path)
-        user = manager.get_user_by_api_key(api_key)
-        
+        # 先查进程内缓存；未命中再走数据库
+        now = time.monotonic()
+        cached = _api_key_cache.get(api_key)
+        if cached and now < cached[0]:
+            user = cached[1]
+        else:
+            from users import UserManager
+
+            manager = UserManager(self.db_path)
+            user = manager.get_user_by_api_key(api_key)
+            if user:
+                _api_key_cache[api_key] = (now + _API_KEY_CACHE_TTL, user)
+
         if not user:
             logger.warning(f"No user found for API key {api_key[:8]}...")
             return False
         
-        return await self._send_feishu_message(
+        return await self._enqueue_send(
             user["open_id"],
             message,
             request_id
         )
     
+    async def _enqueue_send(
+        self,
+        open_id: str,
+        message: str,
+        request_id: str
+    ) -> bool:
+        """入队一条待发送消息并等待批量发送结果"""
+        if self._send_queue is None:
+            self._send_queue = asyncio.Queue()
+            self._send_worker = asyncio.create_task(self._send_loop())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._send_queue.put((open_id, message, request_id, future))
+        return await future
+
+    async def _send_loop(self):
+        """后台任务：攒批后并发发送，结果通过 future 回传"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._send_queue.get()]
+            deadline = loop.time() + _SEND_BATCH_WINDOW
+            while len(batch) < _SEND_BATCH_MAX:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self._send_queue.get(), timeout=remaining)
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            results = await asyncio.gather(
+                *[self._send_feishu_message(o, m, r) for o, m, r, _ in batch],
+                return_exceptions=True
+            )
+            for (_, _, _, future), result in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
     async def receive_reply(
         self,
         open_id: str,
@@ -206,40 +334,33 @@ class MessageRouter:
         Returns:
             Dict: 包含匹配信息的字典
         """
-        # 查找该用户最早的待处理请求
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.execute('''
-                SELECT id, question FROM intent_queue 
-                WHERE open_id = ? AND status = 'PENDING'
-                ORDER BY created_at ASC
-                LIMIT 1
-            ''', (open_id,))
-            
-            row = cursor.fetchone()
-            
-            if not row:
-                logger.warning(f"No pending request for user {open_id}")
-                return {"matched": False, "request_id": None}
-            
-            request_id = row["id"]
-            
-            # 更新请求状态
-            conn.execute('''
-                UPDATE intent_queue SET
-                    answer = ?,
-                    status = 'COMPLETED',
-                    completed_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (reply_text, request_id))
-            
-            logger.info(f"Matched reply to request {request_id} for user {open_id}")
-            
-            return {
-                "matched": True,
-                "request_id": request_id,
-                "question": row["question"]
-            }
+        # 单条语句完成"找该用户最早的待处理请求并写入回复"，
+        # 消除 SELECT 与 UPDATE 之间的并发竞争窗口
+        cursor = self._conn().execute('''
+            UPDATE intent_queue SET
+                answer = ?,
+                status = 'COMPLETED',
+                completed_at = CURRENT_TIMESTAMP
+            WHERE id = (SELECT id FROM intent_queue
+                        WHERE open_id = ? AND status = 'PENDING'
+                        ORDER BY created_at ASC LIMIT 1)
+            RETURNING id, question
+        ''', (reply_text, open_id))
+
+        row = cursor.fetchone()
+
+        if not row:
+            logger.warning(f"No pending request for user {open_id}")
+            return {"matched": False, "request_id": None}
+
+        request_id = row[0]
+        logger.info(f"Matched reply to request {request_id} for user {open_id}")
+
+        return {
+            "matched": True,
+            "request_id": request_id,
+            "question": row[1]
+        }
     
     def get_reply(self, request_id: str) -> Optional[str]:
         """
@@ -251,16 +372,15 @@ class MessageRouter:
         Returns:
             回复内容，如果未回复则返回 None
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "SELECT answer, status FROM intent_queue WHERE id = ?",
-                (request_id,)
-            )
-            row = cursor.fetchone()
-            
-            if row and row[1] == 'COMPLETED':
-                return row[0]
-        
+        cursor = self._conn().execute(
+            "SELECT answer, status FROM intent_queue WHERE id = ?",
+            (request_id,)
+        )
+        row = cursor.fetchone()
+
+        if row and row[1] == 'COMPLETED':
+            return row[0]
+
         return None
     
     async def _send_feishu_message(
@@ -281,17 +401,14 @@ class MessageRouter:
             bool: 是否发送成功
         """
         try:
-            if self._feishu_service is None:
-                from feishu import feishu_service
-                self._feishu_service = feishu_service
-            
-            # 使用飞书服务发送消息
-            result = self._feishu_service.send_message_to_user(
+            # 底层 SDK 调用是同步网络 IO，丢进线程池以免阻塞事件循环
+            result = await asyncio.to_thread(
+                self._feishu_service.send_message_to_user,
                 open_id=open_id,
                 request_id=request_id,
                 message=message
             )
-            
+
             return result
             
         except Exception as e:
@@ -305,11 +422,10 @@ class MessageRouter:
         Args:
             days: 保留天数
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                DELETE FROM intent_queue 
-                WHERE status = 'COMPLETED' 
-                AND completed_at < datetime('now', ?)
-            ''', (f'-{days} days',))
-            
-            logger.info(f"Cleaned up requests older than {days} days")
+        self._conn().execute('''
+            DELETE FROM intent_queue 
+            WHERE status = 'COMPLETED' 
+            AND completed_at < datetime('now', ?)
+        ''', (f'-{days} days',))
+
+        logger.info(f"Cleaned up requests older than {days} days")
@@ -11,12 +11,55 @@ import time
 import uvicorn
 
 from core import mcp, logger, DATA_DIR, LOG_PATH
+from paths import DB_PATH
 from web import app
 
+# How often the background retention sweep runs; how long completed
+# requests are kept comes from the shared retention setting
+_CLEANUP_PERIOD = 3600
+
+
+def _cleanup_loop():
+    """Periodically purge old completed requests so hot-query indexes
+    stay sized to live rows instead of growing with history."""
+    from core import HISTORY_RETENTION_DAYS
+    from routing import MessageRouter
+
+    router = MessageRouter(DB_PATH)
+    while True:
+        try:
+            router.cleanup_old_requests(days=HISTORY_RETENTION_DAYS)
+        except Exception as e:
+            logger.error(f"Periodic cleanup failed: {e}")
+        time.sleep(_CLEANUP_PERIOD)
+
+
+def _start_cleanup_thread():
+    """Start the retention sweep as a daemon thread (skipped when
+    retention is disabled via USERINTENT_HISTORY_DAYS <= 0)."""
+    from core import HISTORY_RETENTION_DAYS
+
+    if HISTORY_RETENTION_DAYS <= 0:
+        return
+    threading.Thread(target=_cleanup_loop, daemon=True).start()
+
 
 def run_web_server(host: str = "0.0.0.0", port: int = 8000):
     """Run the FastAPI web server."""
-    uvicorn.run(app, host=host, port=port, log_level="warning")
+    # Prefer uvloop + httptools when installed - loop/parser overhead is
+    # a large fraction of each small request and each SSE keepalive
+    extra_kwargs = {}
+    try:
+        import uvloop  # noqa: F401
+        import httptools  # noqa: F401
+        extra_kwargs = {"loop": "uvloop", "http": "httptools"}
+    except ImportError:
+        pass
+
+    uvicorn.run(
+        app, host=host, port=port, log_level="warning",
+        access_log=False, **extra_kwargs
+    )
 
 
 def main():
@@ -56,7 +99,9 @@ def main():
         
         # Mount MCP SSE transport
         app.mount("/mcp", mcp.http_app(transport='sse'))
-        
+
+        _start_cleanup_thread()
+
         run_web_server(port=args.port)
         
     elif args.mode == "stdio":
@@ -65,6 +110,8 @@ def main():
         
         web_thread = threading.Thread(target=run_web_server, kwargs={"port": args.port}, daemon=True)
         web_thread.start()
+
+        _start_cleanup_thread()
         
         # Give web server time to start
         time.sleep(1)
@@ -90,23 +137,32 @@ def main():
                 raise
 
 
+# Exception type names treated as a client disconnect. Matching by name
+# avoids importing anyio just to reference its error classes.
+_DISCONNECT_NAMES = frozenset({
+    "BrokenPipeError",
+    "ConnectionResetError",
+    "EOFError",
+    "BrokenResourceError",
+    "ClosedResourceError",
+})
+
+
 def _is_client_disconnect_error(exc: BaseException) -> bool:
     """Check if the exception is a client disconnection error."""
-    # Direct connection errors
-    if isinstance(exc, (BrokenPipeError, ConnectionResetError, EOFError)):
-        return True
-    
-    # Check by class name for anyio errors (avoid import dependency)
-    exc_type_name = type(exc).__name__
-    if exc_type_name == "BrokenResourceError":
-        return True
-    
-    # Handle ExceptionGroup / BaseExceptionGroup
-    if isinstance(exc, BaseException) and hasattr(exc, 'exceptions'):
-        # It's an exception group - check all sub-exceptions
-        return all(_is_client_disconnect_error(sub_exc) for sub_exc in exc.exceptions)
+    # Flatten ExceptionGroups iteratively - no recursion frames, and we
+    # bail out on the first exception that is not a disconnect
+    stack = [exc]
+    while stack:
+        e = stack.pop()
+        sub_excs = getattr(e, 'exceptions', None)
+        if sub_excs is not None:
+            # Exception group - every leaf must be a disconnect
+            stack.extend(sub_excs)
+        elif type(e).__name__ not in _DISCONNECT_NAMES:
+            return False
     
-    return False
+    return True
 
 
 if __name__ == "__main__":
@@ -4,9 +4,87 @@
 
 import sqlite3
 import secrets
+import threading
 import time
 from typing import Optional, Dict, Any, List
 
+from db_pool import get_read_conn, get_write_conn
+
+# 列名缓存：按 cursor.description 记住一次列名元组，
+# 行转字典走 zip + dict 的 C 路径，不用每行遍历 description
+_cols_cache: Dict[tuple, tuple] = {}
+
+
+def _row_to_dict(cursor, row) -> Dict[str, Any]:
+    """把一行查询结果转成普通字典（热路径，每个认证请求都会走）"""
+    desc = cursor.description
+    cols = _cols_cache.get(desc)
+    if cols is None:
+        cols = tuple(d[0] for d in desc)
+        _cols_cache[desc] = cols
+    return dict(zip(cols, row))
+
+
+# API Key -> (过期时刻, 用户信息)。API Key 高熵且基本不变，
+# 每个认证请求都查一次库太浪费；写路径主动失效，TTL 兜底
+_api_key_cache: Dict[str, tuple] = {}
+_api_key_cache_lock = threading.Lock()
+_API_KEY_CACHE_TTL = 60
+_API_KEY_CACHE_MAX = 10000
+
+
+# SQL 常量：模块级单例让每次调用传入同一个字符串对象，
+# 连接的预编译语句缓存按文本精确匹配即可命中
+_SQL_INSERT_USER = '''
+    INSERT INTO users (
+        open_id, union_id, user_id, name, en_name,
+        avatar_url, avatar_thumb, email, mobile, tenant_key,
+        api_key, access_token, refresh_token, token_expires_at,
+        is_active, created_at, updated_at, last_login_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?)
+    RETURNING *
+'''
+
+_SQL_UPDATE_USER_INFO = '''
+    UPDATE users SET
+        union_id = COALESCE(?, union_id),
+        user_id = COALESCE(?, user_id),
+        name = ?,
+        en_name = COALESCE(?, en_name),
+        avatar_url = COALESCE(?, avatar_url),
+        avatar_thumb = COALESCE(?, avatar_thumb),
+        email = COALESCE(?, email),
+        mobile = COALESCE(?, mobile),
+        tenant_key = COALESCE(?, tenant_key),
+        access_token = COALESCE(?, access_token),
+        refresh_token = COALESCE(?, refresh_token),
+        token_expires_at = COALESCE(?, token_expires_at),
+        updated_at = ?,
+        last_login_at = ?
+    WHERE open_id = ?
+    RETURNING *
+'''
+
+
+def _now_s() -> int:
+    """当前 Unix 秒（整型路径，避免 float 中转）"""
+    return time.time_ns() // 1_000_000_000
+
+
+def _invalidate_api_key(api_key: Optional[str]) -> None:
+    """把某个 API Key 从缓存中移除（用户信息变更时调用）"""
+    if api_key:
+        with _api_key_cache_lock:
+            _api_key_cache.pop(api_key, None)
+
+
+def _invalidate_open_id(open_id: str) -> None:
+    """清掉缓存里属于某用户的条目（旧 API Key 不可知时使用）"""
+    with _api_key_cache_lock:
+        stale = [k for k, v in _api_key_cache.items() if v[1].get("open_id") == open_id]
+        for k in stale:
+            del _api_key_cache[k]
+
 
 class UserManager:
     """用户管理器"""
@@ -17,7 +95,7 @@ class UserManager:
     
     def _init_db(self):
         """初始化数据库表"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_write_conn(self.db_path) as conn:
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -90,25 +168,20 @@ class UserManager:
             创建的用户信息字典
         """
         api_key = self._generate_api_key()
-        now = int(time.time())
+        now = _now_s()
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute('''
-                    INSERT INTO users (
-                        open_id, union_id, user_id, name, en_name,
-                        avatar_url, avatar_thumb, email, mobile, tenant_key,
-                        api_key, access_token, refresh_token, token_expires_at,
-                        is_active, created_at, updated_at, last_login_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?)
-                ''', (
+            # RETURNING 让插入和读回同一条语句完成
+            with get_write_conn(self.db_path) as conn:
+                cursor = conn.execute(_SQL_INSERT_USER, (
                     open_id, union_id, user_id, name, en_name,
                     avatar_url, avatar_thumb, email, mobile, tenant_key,
                     api_key, access_token, refresh_token, token_expires_at,
                     now, now, now
                 ))
-            
-            return self.get_user_by_open_id(open_id)
+                row = cursor.fetchone()
+
+            return _row_to_dict(cursor, row) if row else None
             
         except sqlite3.IntegrityError:
             # 用户已存在，更新信息
@@ -135,34 +208,22 @@ class UserManager:
         token_expires_at: Optional[int]
     ) -> Optional[Dict[str, Any]]:
         """更新已存在用户的信息"""
-        now = int(time.time())
+        now = _now_s()
         
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                UPDATE users SET
-                    union_id = COALESCE(?, union_id),
-                    user_id = COALESCE(?, user_id),
-                    name = ?,
-                    en_name = COALESCE(?, en_name),
-                    avatar_url = COALESCE(?, avatar_url),
-                    avatar_thumb = COALESCE(?, avatar_thumb),
-                    email = COALESCE(?, email),
-                    mobile = COALESCE(?, mobile),
-                    tenant_key = COALESCE(?, tenant_key),
-                    access_token = COALESCE(?, access_token),
-                    refresh_token = COALESCE(?, refresh_token),
-                    token_expires_at = COALESCE(?, token_expires_at),
-                    updated_at = ?,
-                    last_login_at = ?
-                WHERE open_id = ?
-            ''', (
+        with get_write_conn(self.db_path) as conn:
+            cursor = conn.execute(_SQL_UPDATE_USER_INFO, (
                 union_id, user_id, name, en_name,
                 avatar_url, avatar_thumb, email, mobile, tenant_key,
                 access_token, refresh_token, token_expires_at,
                 now, now, open_id
             ))
-        
-        return self.get_user_by_open_id(open_id)
+            row = cursor.fetchone()
+
+        if row:
+            user = _row_to_dict(cursor, row)
+            _invalidate_api_key(user.get("api_key"))
+            return user
+        return None
     
     def get_user_by_open_id(self, open_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -174,8 +235,7 @@ class UserManager:
         Returns:
             用户信息字典，如果不存在则返回 None
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_read_conn(self.db_path) as conn:
             cursor = conn.execute(
                 "SELECT * FROM users WHERE open_id = ?",
                 (open_id,)
@@ -183,7 +243,7 @@ class UserManager:
             row = cursor.fetchone()
             
             if row:
-                return dict(row)
+                return _row_to_dict(cursor, row)
         
         return None
     
@@ -197,8 +257,13 @@ class UserManager:
         Returns:
             用户信息字典，如果不存在或用户已禁用则返回 None
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        now = time.monotonic()
+        with _api_key_cache_lock:
+            cached = _api_key_cache.get(api_key)
+            if cached and now < cached[0]:
+                return cached[1]
+
+        with get_read_conn(self.db_path) as conn:
             cursor = conn.execute(
                 "SELECT * FROM users WHERE api_key = ? AND is_active = 1",
                 (api_key,)
@@ -206,7 +271,17 @@ class UserManager:
             row = cursor.fetchone()
             
             if row:
-                return dict(row)
+                user = _row_to_dict(cursor, row)
+                with _api_key_cache_lock:
+                    if len(_api_key_cache) >= _API_KEY_CACHE_MAX:
+                        # 先清过期项，仍超限就淘汰最早插入的条目
+                        expired = [k for k, v in _api_key_cache.items() if v[0] <= now]
+                        for k in expired:
+                            del _api_key_cache[k]
+                        while len(_api_key_cache) >= _API_KEY_CACHE_MAX:
+                            del _api_key_cache[next(iter(_api_key_cache))]
+                    _api_key_cache[api_key] = (now + _API_KEY_CACHE_TTL, user)
+                return user
         
         return None
     
@@ -221,16 +296,19 @@ class UserManager:
             新的 API Key，如果用户不存在则返回 None
         """
         new_api_key = self._generate_api_key()
-        now = int(time.time())
-        
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "UPDATE users SET api_key = ?, updated_at = ? WHERE open_id = ?",
+        now = _now_s()
+
+        with get_write_conn(self.db_path) as conn:
+            row = conn.execute(
+                "UPDATE users SET api_key = ?, updated_at = ? WHERE open_id = ? "
+                "RETURNING api_key",
                 (new_api_key, now, open_id)
-            )
-            
-            if cursor.rowcount > 0:
-                return new_api_key
+            ).fetchone()
+
+        if row:
+            # 旧 Key 立即失效，不等 TTL
+            _invalidate_open_id(open_id)
+            return new_api_key
         
         return None
     
@@ -253,19 +331,23 @@ class UserManager:
         Returns:
             bool: 是否更新成功
         """
-        now = int(time.time())
+        now = _now_s()
         
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute('''
+        with get_write_conn(self.db_path) as conn:
+            row = conn.execute('''
                 UPDATE users SET
                     access_token = ?,
                     refresh_token = ?,
                     token_expires_at = ?,
                     updated_at = ?
                 WHERE open_id = ?
-            ''', (access_token, refresh_token, expires_at, now, open_id))
-            
-            return cursor.rowcount > 0
+                RETURNING api_key
+            ''', (access_token, refresh_token, expires_at, now, open_id)).fetchone()
+
+        if row:
+            _invalidate_api_key(row[0])
+            return True
+        return False
     
     def disable_user(self, open_id: str) -> bool:
         """
@@ -277,15 +359,19 @@ class UserManager:
         Returns:
             bool: 是否禁用成功
         """
-        now = int(time.time())
+        now = _now_s()
         
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "UPDATE users SET is_active = 0, updated_at = ? WHERE open_id = ?",
+        with get_write_conn(self.db_path) as conn:
+            row = conn.execute(
+                "UPDATE users SET is_active = 0, updated_at = ? WHERE open_id = ? "
+                "RETURNING api_key",
                 (now, open_id)
-            )
-            
-            return cursor.rowcount > 0
+            ).fetchone()
+
+        if row:
+            _invalidate_api_key(row[0])
+            return True
+        return False
     
     def enable_user(self, open_id: str) -> bool:
         """
@@ -297,36 +383,58 @@ class UserManager:
         Returns:
             bool: 是否启用成功
         """
-        now = int(time.time())
+        now = _now_s()
         
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "UPDATE users SET is_active = 1, updated_at = ? WHERE open_id = ?",
+        with get_write_conn(self.db_path) as conn:
+            row = conn.execute(
+                "UPDATE users SET is_active = 1, updated_at = ? WHERE open_id = ? "
+                "RETURNING api_key",
                 (now, open_id)
-            )
-            
-            return cursor.rowcount > 0
+            ).fetchone()
+
+        if row:
+            _invalidate_api_key(row[0])
+            return True
+        return False
     
     def list_users(
         self,
         tenant_key: Optional[str] = None,
         include_disabled: bool = False,
         limit: int = 100,
-        offset: int = 0
-    ) -> List[Dict[str, Any]]:
+        offset: int = 0,
+        columnar: bool = False,
+        redacted: bool = False
+    ) -> Any:
         """
         获取用户列表
-        
+
         Args:
             tenant_key: 可选，按租户筛选
             include_disabled: 是否包含已禁用的用户
             limit: 返回数量限制
             offset: 偏移量
-            
+            columnar: 按列返回 {"columns": [...], "rows": [...]}，
+                大列表序列化时不必每行重复一遍键名
+            redacted: 在 SQL 里完成敏感字段脱敏，
+                免去调用方逐行改写字典
+
         Returns:
-            用户列表
+            用户列表（columnar 时为列式字典）
         """
-        query = "SELECT * FROM users WHERE 1=1"
+        if limit <= 0:
+            return {"columns": [], "rows": []} if columnar else []
+
+        if redacted:
+            query = ("SELECT id, open_id, union_id, user_id, name, en_name, "
+                     "avatar_url, avatar_thumb, email, mobile, tenant_key, "
+                     "substr(api_key, 1, 8) || '...' AS api_key, "
+                     "CASE WHEN access_token IS NOT NULL THEN '***' END AS access_token, "
+                     "CASE WHEN refresh_token IS NOT NULL THEN '***' END AS refresh_token, "
+                     "token_expires_at, is_active, created_at, updated_at, "
+                     "last_login_at FROM users WHERE 1=1")
+        else:
+            query = "SELECT * FROM users WHERE 1=1"
         params = []
         
         if tenant_key:
@@ -339,18 +447,22 @@ class UserManager:
         query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
         params.extend([limit, offset])
         
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with get_read_conn(self.db_path) as conn:
             cursor = conn.execute(query, params)
-            
-            return [dict(row) for row in cursor.fetchall()]
+
+            if columnar:
+                return {
+                    "columns": [d[0] for d in cursor.description],
+                    "rows": [tuple(row) for row in cursor.fetchall()],
+                }
+            return [_row_to_dict(cursor, row) for row in cursor.fetchall()]
     
     def _generate_api_key(self) -> str:
         """
         生成 API Key
         
         Returns:
-            格式: uk_<32位随机字符>
+            格式: uk_<24位随机字符>（144 位熵，URL 安全编码比
+            hex 短三分之一，api_key 索引也随之变小）
         """
-        random_part = secrets.token_hex(16)  # 32字符
-        return f"uk_{random_part}"
+        return "uk_" + secrets.token_urlsafe(18)  # 24字符
@@ -1,18 +1,29 @@
 """
 Web module - FastAPI application for the Web UI.
 """
-import sqlite3
+import hashlib
+import json
 import logging
 from typing import Optional
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, FileResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 import os
 
-from core import DB_PATH, BASE_DIR, get_feishu_service
+from core import DB_PATH, BASE_DIR, get_feishu_service, notify_reply
+from db_pool import get_read_conn, get_write_conn, run_db
+
+# orjson parses small JSON bodies several times faster than the stdlib;
+# fall back silently when it is not installed
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 
 
 logger = logging.getLogger("user_intent_mcp")
@@ -23,66 +34,148 @@ app = FastAPI(title="User Intent MCP", description="AI Agent User Intent Collect
 # Templates & Static
 STATIC_DIR = os.path.join(BASE_DIR, "src", "static")
 TEMPLATES_DIR = os.path.join(BASE_DIR, "src", "templates")
-templates = Jinja2Templates(directory=TEMPLATES_DIR)
+
+# Built on first use - the template engine is only needed by "/", and
+# instantiating it at import slows every consumer of this module
+_templates = None
+
+
+def _get_templates() -> Jinja2Templates:
+    global _templates
+    if _templates is None:
+        _templates = Jinja2Templates(directory=TEMPLATES_DIR)
+    return _templates
+
+
+# index.html takes no template variables, so render it once and serve the
+# cached bytes; the ETag lets repeat visitors get a 304 instead of the body
+_index_html: Optional[str] = None
+_index_etag: Optional[str] = None
+
+
+def _get_index() -> tuple:
+    global _index_html, _index_etag
+    if _index_html is None:
+        _index_html = _get_templates().env.get_template("index.html").render()
+        _index_etag = f'"{hashlib.blake2b(_index_html.encode()).hexdigest()[:16]}"'
+    return _index_html, _index_etag
 
 if os.path.exists(STATIC_DIR):
     app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
-@app.get("/sw.js")
-async def get_sw():
-    return FileResponse(os.path.join(STATIC_DIR, "sw.js"))
+# The service worker is re-fetched aggressively by browsers; serve it from
+# memory with an ETag instead of stat()ing the file per request
+_SW_PATH = os.path.join(STATIC_DIR, "sw.js")
+try:
+    with open(_SW_PATH, "rb") as f:
+        _SW_BYTES = f.read()
+    _SW_ETAG = f'"{hashlib.blake2b(_SW_BYTES).hexdigest()[:16]}"'
+except OSError:
+    _SW_BYTES = None
+    _SW_ETAG = None
 
 
-# --- Pydantic Models ---
-class ReplyModel(BaseModel):
-    id: str
-    answer: str
-    image: Optional[str] = None
+@app.get("/sw.js")
+async def get_sw(request: Request):
+    if _SW_BYTES is None:
+        return FileResponse(_SW_PATH)
+    headers = {"ETag": _SW_ETAG, "Cache-Control": "max-age=3600"}
+    if request.headers.get("if-none-match") == _SW_ETAG:
+        return Response(status_code=304, headers=headers)
+    return Response(_SW_BYTES, media_type="application/javascript", headers=headers)
 
 
 # --- Routes ---
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serve the main Web UI."""
-    return templates.TemplateResponse(request, "index.html")
+    html, etag = _get_index()
+    if request.headers.get("if-none-match") == etag:
+        return HTMLResponse(status_code=304, headers={"ETag": etag})
+    return HTMLResponse(html, headers={"ETag": etag})
 
 
 @app.get("/api/poll")
-async def poll_question():
-    """Returns list of all pending questions."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute(
-            "SELECT id, question FROM intent_queue WHERE status = 'PENDING'"
-        )
-        rows = cursor.fetchall()
+async def poll_question(since_id: Optional[int] = None):
+    """Returns pending questions.
+
+    Without `since_id` the full PENDING list is returned (legacy list
+    shape). With `since_id` only rows inserted after that cursor are
+    returned as `{"items": [...], "cursor": <opaque int>}`; pass the
+    cursor back on the next poll so payload size tracks the delta, not
+    the queue. The cursor is the row's rowid - request ids themselves
+    are random, so they cannot order "new since last poll".
+    """
+    def _query():
+        with get_read_conn(DB_PATH) as conn:
+            if since_id is not None:
+                return conn.execute(
+                    "SELECT rowid, id, question FROM intent_queue "
+                    "WHERE status = 'PENDING' AND rowid > ? ORDER BY rowid",
+                    (since_id,)
+                ).fetchall()
+            return conn.execute(
+                "SELECT id, question FROM intent_queue WHERE status = 'PENDING'"
+            ).fetchall()
+
+    rows = await run_db(_query)
+    if since_id is not None:
+        return {
+            "items": [{"id": row[1], "question": row[2]} for row in rows],
+            "cursor": rows[-1][0] if rows else since_id,
+        }
     return [{"id": row[0], "question": row[1]} for row in rows]
 
 
 @app.post("/api/reply")
-async def receive_reply(reply: ReplyModel):
+async def receive_reply(request: Request):
     """Receives a reply for a specific question."""
-    logger.info(f"Received reply for {reply.id}: text={reply.answer[:50] if reply.answer else 'None'}..., image={'YES (' + str(len(reply.image)) + ' chars)' if reply.image else 'NO'}")
-    
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            "UPDATE intent_queue SET answer = ?, image = ?, status = 'COMPLETED', completed_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (reply.answer, reply.image, reply.id)
+    # Hot endpoint: decode the flat body directly instead of running it
+    # through Pydantic's per-field validator pipeline
+    try:
+        data = _loads(await request.body())
+        reply_id = data["id"]
+        answer = data["answer"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=422, detail="id and answer are required")
+    image = data.get("image")
+
+    # Level guard keeps the slicing and string building off the hot path
+    # when INFO logging is disabled
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Received reply for %s: text=%.50s..., image=%s",
+            reply_id, answer or "None",
+            f"YES ({len(image)} chars)" if image else "NO"
         )
+    
+    def _write():
+        with get_write_conn(DB_PATH) as conn:
+            conn.execute(
+                "UPDATE intent_queue SET answer = ?, image = ?, status = 'COMPLETED', completed_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (answer, image, reply_id)
+            )
+
+    await run_db(_write)
+    # Wake the waiting MCP coroutine immediately instead of its next poll tick
+    notify_reply(reply_id)
     return {"status": "success"}
 
 
 @app.get("/api/history")
 async def get_history():
     """Returns list of completed questions (history)."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute(
-            """SELECT id, question, answer, completed_at 
-               FROM intent_queue 
-               WHERE status = 'COMPLETED' 
-               ORDER BY completed_at DESC
-               LIMIT 50"""
-        )
-        rows = cursor.fetchall()
+    def _query():
+        with get_read_conn(DB_PATH) as conn:
+            return conn.execute(
+                """SELECT id, question, answer, completed_at 
+                   FROM intent_queue 
+                   WHERE status = 'COMPLETED' 
+                   ORDER BY completed_at DESC
+                   LIMIT 50"""
+            ).fetchall()
+
+    rows = await run_db(_query)
     return [
         {
             "id": row[0], 
@@ -97,39 +190,51 @@ async def get_history():
 @app.delete("/api/request/{request_id}")
 async def delete_request(request_id: str):
     """Dismisses a specific request."""
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            "UPDATE intent_queue SET status = 'DISMISSED' WHERE id = ?",
-            (request_id,)
-        )
+    def _write():
+        with get_write_conn(DB_PATH) as conn:
+            conn.execute(
+                "UPDATE intent_queue SET status = 'DISMISSED' WHERE id = ?",
+                (request_id,)
+            )
+
+    await run_db(_write)
+    notify_reply(request_id)
     return {"status": "dismissed"}
 
 
 @app.delete("/api/history/{history_id}")
 async def delete_history_item(history_id: str):
     """Deletes a specific history item."""
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            "DELETE FROM intent_queue WHERE id = ? AND status = 'COMPLETED'",
-            (history_id,)
-        )
+    def _write():
+        with get_write_conn(DB_PATH) as conn:
+            conn.execute(
+                "DELETE FROM intent_queue WHERE id = ? AND status = 'COMPLETED'",
+                (history_id,)
+            )
+
+    await run_db(_write)
     return {"status": "deleted"}
 
 
-class DeleteHistoryModel(BaseModel):
-    ids: list[str]
-
-
 @app.post("/api/history/delete")
-async def delete_history_batch(data: DeleteHistoryModel):
+async def delete_history_batch(request: Request):
     """Deletes multiple history items."""
-    with sqlite3.connect(DB_PATH) as conn:
-        placeholders = ','.join(['?' for _ in data.ids])
-        conn.execute(
-            f"DELETE FROM intent_queue WHERE id IN ({placeholders}) AND status = 'COMPLETED'",
-            data.ids
-        )
-    return {"status": "deleted", "count": len(data.ids)}
+    try:
+        ids = _loads(await request.body())["ids"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=422, detail="ids is required")
+
+    # executemany inside the pool's single write transaction: one fsync
+    # for the whole batch, and no IN(...) parse cost or 999-parameter cap
+    def _write():
+        with get_write_conn(DB_PATH) as conn:
+            conn.executemany(
+                "DELETE FROM intent_queue WHERE id = ? AND status = 'COMPLETED'",
+                [(x,) for x in ids]
+            )
+
+    await run_db(_write)
+    return {"status": "deleted", "count": len(ids)}
 
 
 # --- Feishu API Endpoints ---
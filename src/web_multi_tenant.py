@@ -2,17 +2,21 @@
 多租户 Web API 模块 - FastAPI 应用
 """
 
+import hashlib
+import json
 import os
+import threading
 import time
 from typing import Optional
-from fastapi import FastAPI, HTTPException, Depends, Header, Request, Query
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Query, Response
 from fastapi.responses import RedirectResponse, JSONResponse, HTMLResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
 # 导入 MCP 服务
-from core import mcp
+from core import mcp, notify_reply
+from db_pool import get_read_conn, get_write_conn, close_all, pool_stats, run_db
 
 # 数据库路径
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -94,6 +98,16 @@ async def shutdown_event():
     except Exception as e:
         logger.error(f"Error stopping WebSocket listener: {e}")
 
+    # 关闭 OAuth 的长连接 HTTP 客户端
+    if _oauth_instance is not None:
+        try:
+            await _oauth_instance.aclose()
+        except Exception as e:
+            logger.error(f"Error closing OAuth client: {e}")
+
+    # 归还全部池化数据库连接
+    close_all()
+
 
 # ============================================================================
 # Pydantic 模型
@@ -130,10 +144,31 @@ class FeishuConfigRequest(BaseModel):
 # 依赖项
 # ============================================================================
 
+# AdminAuth 单例：每个请求新建实例要重开连接、重跑 DDL、重算
+# dummy 哈希（scrypt），还会丢掉实例内的会话验证缓存，
+# verify_admin_session 因此每次都落库。按 inode 识别数据库文件
+# 被替换的情况（测试会删掉重建），替换后重建实例
+_admin_auth_instance = None
+_admin_auth_file_id = None
+
+
 def get_admin_auth():
-    """获取管理员认证实例"""
+    """获取管理员认证实例（单例，数据库文件被替换时重建）"""
+    global _admin_auth_instance, _admin_auth_file_id
     from auth import AdminAuth
-    return AdminAuth(DB_PATH)
+
+    try:
+        st = os.stat(DB_PATH)
+        file_id = (st.st_dev, st.st_ino)
+    except OSError:
+        file_id = None
+
+    if _admin_auth_instance is None or file_id is None or file_id != _admin_auth_file_id:
+        _admin_auth_instance = AdminAuth(DB_PATH)
+        st = os.stat(DB_PATH)
+        _admin_auth_file_id = (st.st_dev, st.st_ino)
+
+    return _admin_auth_instance
 
 
 def get_user_manager():
@@ -145,34 +180,42 @@ def get_user_manager():
 # OAuth 单例缓存
 _oauth_instance = None
 _oauth_config_hash = None
+# 配置读取缓存：配置极少变化但 get_oauth 每个 OAuth 请求都会调用；
+# 写入端调用 invalidate_oauth_config() 主动失效，TTL 兜底
+_oauth_config_cache: Optional[tuple] = None  # (过期时刻, app_id, app_secret, redirect_uri)
+_OAUTH_CONFIG_TTL = 30
+
+
+def invalidate_oauth_config():
+    """飞书配置写入后调用，让 get_oauth 下次重读数据库"""
+    global _oauth_config_cache
+    _oauth_config_cache = None
 
 
 def get_oauth():
     """获取 OAuth 实例（单例模式）"""
-    global _oauth_instance, _oauth_config_hash
+    global _oauth_instance, _oauth_config_hash, _oauth_config_cache
     from oauth import FeishuOAuth
-    
-    # 从数据库获取飞书配置
-    import sqlite3
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute(
-            "SELECT value FROM admin_config WHERE key = 'feishu_app_id'"
-        )
-        row = cursor.fetchone()
-        app_id = row[0] if row else None
-        
-        cursor = conn.execute(
-            "SELECT value FROM admin_config WHERE key = 'feishu_app_secret'"
-        )
-        row = cursor.fetchone()
-        app_secret = row[0] if row else None
-        
-        cursor = conn.execute(
-            "SELECT value FROM admin_config WHERE key = 'feishu_redirect_uri'"
+
+    now = time.monotonic()
+    cached = _oauth_config_cache
+    if cached and now < cached[0]:
+        app_id, app_secret, redirect_uri = cached[1], cached[2], cached[3]
+    else:
+        # 一条 IN 查询取回全部三个配置项
+        with get_read_conn(DB_PATH) as conn:
+            rows = dict(conn.execute(
+                "SELECT key, value FROM admin_config WHERE key IN (?, ?, ?)",
+                ("feishu_app_id", "feishu_app_secret", "feishu_redirect_uri")
+            ).fetchall())
+
+        app_id = rows.get("feishu_app_id")
+        app_secret = rows.get("feishu_app_secret")
+        redirect_uri = rows.get(
+            "feishu_redirect_uri", "http://localhost:8000/auth/feishu/callback"
         )
-        row = cursor.fetchone()
-        redirect_uri = row[0] if row else "http://localhost:8000/auth/feishu/callback"
-    
+        _oauth_config_cache = (now + _OAUTH_CONFIG_TTL, app_id, app_secret, redirect_uri)
+
     if not app_id or not app_secret:
         return None
     
@@ -186,6 +229,62 @@ def get_oauth():
     return _oauth_instance
 
 
+# 进程内令牌桶限流：登录要跑刻意放慢的口令哈希，OAuth 回调会出网
+# 调飞书，两者都可被外部无凭据触发；桶空后 Retry-After 指数翻倍
+class _TokenBucket:
+    """按 key 限流的令牌桶，拒绝后的退避时间逐次翻倍"""
+
+    MAX_RETRY_AFTER = 300
+
+    def __init__(self, capacity: int, window: float, max_keys: int = 10000):
+        self.capacity = capacity
+        self.rate = capacity / window  # 令牌/秒
+        self.max_keys = max_keys
+        # key -> [剩余令牌, 上次补充时刻, 当前退避秒数]
+        self._buckets: dict = {}
+        self._lock = threading.Lock()
+
+    def check(self, key: str) -> Optional[int]:
+        """尝试扣一个令牌；放行返回 None，否则返回 Retry-After 秒数"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now)
+                bucket = self._buckets[key] = [float(self.capacity), now, 0]
+            tokens = min(
+                self.capacity, bucket[0] + (now - bucket[1]) * self.rate
+            )
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                bucket[2] = 0
+                return None
+            bucket[0] = tokens
+            wait = int((1 - tokens) / self.rate) + 1
+            bucket[2] = min(max(wait, bucket[2] * 2), self.MAX_RETRY_AFTER)
+            return bucket[2]
+
+    def _prune(self, now: float) -> None:
+        """丢掉已经完全回满的桶，限制表的大小"""
+        full = [
+            key for key, b in self._buckets.items()
+            if b[0] + (now - b[1]) * self.rate >= self.capacity
+        ]
+        for key in full:
+            del self._buckets[key]
+
+
+_login_limiter = _TokenBucket(capacity=5, window=60)
+_callback_limiter = _TokenBucket(capacity=20, window=60)
+
+
+def _client_ip(request: Request) -> str:
+    """取客户端 IP 作为限流 key（无连接信息时归入同一桶）"""
+    return request.client.host if request.client else "-"
+
+
 async def verify_admin_session(
     authorization: Optional[str] = Header(None)
 ) -> bool:
@@ -223,20 +322,34 @@ async def get_current_user(
 # 系统 API
 # ============================================================================
 
+def _etag_json(request: Request, result, max_age: int = 30):
+    """带 ETag/Cache-Control 的 JSON 响应
+
+    管理界面每次换页都会打这些只读端点，命中 If-None-Match
+    时直接回 304，省掉响应体和浏览器侧的重复渲染。
+    """
+    body = json.dumps(result, sort_keys=True, ensure_ascii=False)
+    etag = f'"{hashlib.blake2b(body.encode()).hexdigest()[:16]}"'
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max_age}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(result, headers=headers)
+
+
 @app.get("/api/system/status")
-async def get_system_status():
+async def get_system_status(request: Request):
     """获取系统状态"""
     auth = get_admin_auth()
-    
+
     result = {
         "initialized": auth.is_initialized(),
         "version": "2.0.0"
     }
-    
+
     if auth.is_initialized():
         result["admin_username"] = auth.get_admin_username()
-    
-    return result
+
+    return _etag_json(request, result)
 
 
 @app.post("/api/system/initialize")
@@ -253,8 +366,7 @@ async def initialize_system(request: SystemInitRequest):
         
         # 保存飞书配置（如果提供）
         if request.feishu_app_id and request.feishu_app_secret:
-            import sqlite3
-            with sqlite3.connect(DB_PATH) as conn:
+            with get_write_conn(DB_PATH) as conn:
                 conn.execute(
                     "INSERT OR REPLACE INTO admin_config (key, value) VALUES (?, ?)",
                     ("feishu_app_id", request.feishu_app_id)
@@ -263,6 +375,7 @@ async def initialize_system(request: SystemInitRequest):
                     "INSERT OR REPLACE INTO admin_config (key, value) VALUES (?, ?)",
                     ("feishu_app_secret", request.feishu_app_secret)
                 )
+            invalidate_oauth_config()
         
         return {"success": True, "message": "系统初始化成功"}
         
@@ -275,13 +388,22 @@ async def initialize_system(request: SystemInitRequest):
 # ============================================================================
 
 @app.post("/api/admin/login")
-async def admin_login(request: AdminLoginRequest):
+async def admin_login(request: AdminLoginRequest, http_request: Request):
     """管理员登录"""
+    # 按 IP+用户名限流，挡住暴力猜解把 CPU 钉死在口令哈希上
+    retry_after = _login_limiter.check(f"{_client_ip(http_request)}:{request.username}")
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="尝试过于频繁，请稍后再试",
+            headers={"Retry-After": str(retry_after)}
+        )
+
     auth = get_admin_auth()
-    
+
     if not auth.is_initialized():
         raise HTTPException(status_code=400, detail="系统未初始化")
-    
+
     if not auth.verify_credentials(request.username, request.password):
         raise HTTPException(status_code=401, detail="用户名或密码错误")
     
@@ -327,21 +449,19 @@ async def change_admin_password(
 
 @app.get("/api/admin/users")
 async def list_users(
+    limit: int = 50,
+    offset: int = 0,
     _: bool = Depends(verify_admin_session)
 ):
-    """获取用户列表"""
+    """获取用户列表（分页，脱敏下推到 SQL）"""
     manager = get_user_manager()
-    users = manager.list_users(include_disabled=True)
-    
-    # 脱敏处理
-    for user in users:
-        if user.get("api_key"):
-            user["api_key"] = user["api_key"][:8] + "..."
-        if user.get("access_token"):
-            user["access_token"] = "***"
-        if user.get("refresh_token"):
-            user["refresh_token"] = "***"
-    
+    users = manager.list_users(
+        include_disabled=True,
+        limit=min(max(limit, 0), 200),
+        offset=max(offset, 0),
+        redacted=True
+    )
+
     return {"users": users}
 
 
@@ -375,12 +495,15 @@ async def enable_user(
 
 @app.get("/api/admin/feishu/config")
 async def get_feishu_config(
+    request: Request,
     _: bool = Depends(verify_admin_session)
 ):
     """获取飞书配置（管理员）"""
-    with sqlite3.connect(DB_PATH) as conn:
+    # 显式 IN 列表走 key 主键索引，LIKE 前缀匹配只能全表扫
+    with get_read_conn(DB_PATH) as conn:
         cursor = conn.execute(
-            "SELECT key, value FROM admin_config WHERE key LIKE 'feishu_%'"
+            "SELECT key, value FROM admin_config WHERE key IN (?, ?, ?)",
+            ("feishu_app_id", "feishu_app_secret", "feishu_redirect_uri")
         )
         config = {}
         for key, value in cursor.fetchall():
@@ -391,8 +514,8 @@ async def get_feishu_config(
                 config["app_secret_configured"] = bool(value)
             else:
                 config[config_key] = value
-        
-        return config
+
+        return _etag_json(request, config)
 
 
 @app.post("/api/admin/feishu/config")
@@ -407,20 +530,20 @@ async def update_feishu_config(
     import logging
     logger = logging.getLogger("user_intent_mcp")
     
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            "INSERT OR REPLACE INTO admin_config (key, value) VALUES (?, ?)",
-            ("feishu_app_id", request.app_id)
-        )
-        conn.execute(
+    # 同一条语句只准备一次，三个配置项随事务一次落盘
+    rows = [
+        ("feishu_app_id", request.app_id),
+        ("feishu_app_secret", request.app_secret),
+    ]
+    if request.redirect_uri:
+        rows.append(("feishu_redirect_uri", request.redirect_uri))
+
+    with get_write_conn(DB_PATH) as conn:
+        conn.executemany(
             "INSERT OR REPLACE INTO admin_config (key, value) VALUES (?, ?)",
-            ("feishu_app_secret", request.app_secret)
+            rows
         )
-        if request.redirect_uri:
-            conn.execute(
-                "INSERT OR REPLACE INTO admin_config (key, value) VALUES (?, ?)",
-                ("feishu_redirect_uri", request.redirect_uri)
-            )
+    invalidate_oauth_config()
     
     # 重新加载飞书服务配置（用于发送消息）
     fs = get_feishu_service()
@@ -495,11 +618,21 @@ async def feishu_login():
 
 @app.get("/auth/feishu/callback")
 async def feishu_callback(
+    request: Request,
     code: Optional[str] = None,
     state: Optional[str] = None,
     error: Optional[str] = None
 ):
     """飞书 OAuth 回调"""
+    # 回调可被外部任意触发且会出网调飞书，按 IP 限流
+    retry_after = _callback_limiter.check(_client_ip(request))
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="请求过于频繁，请稍后再试",
+            headers={"Retry-After": str(retry_after)}
+        )
+
     if error:
         raise HTTPException(status_code=400, detail=f"授权失败: {error}")
     
@@ -591,14 +724,40 @@ async def regenerate_api_key(
 # 前端页面路由
 # ============================================================================
 
+# 页面内容在首次访问时读取/编译一次：首页 HTML 是静态文件，
+# 用户中心页只有几个字段会变，Jinja2 模板编译一次后 render 很廉价，
+# autoescape 同时堵上用户名未转义直拼进 HTML 的注入口子
+_index_html: Optional[str] = None
+_index_etag: Optional[str] = None
+_user_template = None
+
+
+def _get_user_template():
+    """返回编译好的用户中心页模板（首次访问时加载）"""
+    global _user_template
+    if _user_template is None:
+        import jinja2
+        with open(os.path.join(TEMPLATES_DIR, "user.html"), encoding="utf-8") as f:
+            _user_template = jinja2.Environment(autoescape=True).from_string(f.read())
+    return _user_template
+
+
 @app.get("/", response_class=HTMLResponse)
-async def index():
+async def index(request: Request):
     """首页 - 根据状态显示不同页面"""
-    template_path = os.path.join(TEMPLATES_DIR, "multi_tenant.html")
-    if os.path.exists(template_path):
+    global _index_html, _index_etag
+    if _index_html is None:
+        template_path = os.path.join(TEMPLATES_DIR, "multi_tenant.html")
+        if not os.path.exists(template_path):
+            return HTMLResponse(content="<h1>Template not found</h1>", status_code=500)
         with open(template_path, "r", encoding="utf-8") as f:
-            return HTMLResponse(content=f.read())
-    return HTMLResponse(content="<h1>Template not found</h1>", status_code=500)
+            _index_html = f.read()
+        _index_etag = f'"{hashlib.blake2b(_index_html.encode()).hexdigest()[:16]}"'
+    # 条件请求命中时省掉整页传输
+    headers = {"ETag": _index_etag, "Cache-Control": "public, max-age=300"}
+    if request.headers.get("if-none-match") == _index_etag:
+        return HTMLResponse(status_code=304, headers=headers)
+    return HTMLResponse(content=_index_html, headers=headers)
 
 
 @app.get("/admin")
@@ -628,268 +787,13 @@ async def user_page(api_key: Optional[str] = None):
         return RedirectResponse(url="/")
     
     # 返回用户中心页面
-    return HTMLResponse(content=f"""
-<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>用户中心 - AI Intent Center</title>
-    <style>
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            padding: 20px;
-        }}
-        .container {{
-            background: white;
-            border-radius: 20px;
-            box-shadow: 0 25px 50px -12px rgba(0, 0, 0, 0.25);
-            padding: 40px;
-            max-width: 500px;
-            width: 100%;
-        }}
-        .header {{
-            text-align: center;
-            margin-bottom: 30px;
-        }}
-        .avatar {{
-            width: 80px;
-            height: 80px;
-            border-radius: 50%;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            margin: 0 auto 20px;
-            font-size: 36px;
-            color: white;
-        }}
-        h1 {{
-            color: #1a1a2e;
-            font-size: 24px;
-            margin-bottom: 8px;
-        }}
-        .subtitle {{
-            color: #6b7280;
-            font-size: 14px;
-        }}
-        .info-card {{
-            background: #f8fafc;
-            border-radius: 12px;
-            padding: 20px;
-            margin-bottom: 20px;
-        }}
-        .info-item {{
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            padding: 12px 0;
-            border-bottom: 1px solid #e2e8f0;
-        }}
-        .info-item:last-child {{
-            border-bottom: none;
-        }}
-        .info-label {{
-            color: #6b7280;
-            font-size: 14px;
-        }}
-        .info-value {{
-            color: #1a1a2e;
-            font-weight: 500;
-            font-size: 14px;
-            word-break: break-all;
-            text-align: right;
-            max-width: 250px;
-        }}
-        .api-key-section {{
-            background: #f0fdf4;
-            border: 1px solid #86efac;
-            border-radius: 12px;
-            padding: 20px;
-            margin-bottom: 20px;
-        }}
-        .api-key-title {{
-            color: #166534;
-            font-weight: 600;
-            margin-bottom: 12px;
-            display: flex;
-            align-items: center;
-            gap: 8px;
-        }}
-        .api-key-value {{
-            background: white;
-            border: 1px solid #d1d5db;
-            border-radius: 8px;
-            padding: 12px;
-            font-family: 'Menlo', 'Monaco', 'Consolas', monospace;
-            font-size: 13px;
-            color: #166534;
-            word-break: break-all;
-            margin-bottom: 12px;
-        }}
-        .copy-btn {{
-            background: #22c55e;
-            color: white;
-            border: none;
-            padding: 8px 16px;
-            border-radius: 6px;
-            cursor: pointer;
-            font-size: 14px;
-            transition: background 0.2s;
-        }}
-        .copy-btn:hover {{
-            background: #16a34a;
-        }}
-        .actions {{
-            display: flex;
-            flex-direction: column;
-            gap: 12px;
-        }}
-        .btn {{
-            padding: 14px 20px;
-            border-radius: 10px;
-            font-size: 15px;
-            font-weight: 500;
-            cursor: pointer;
-            transition: all 0.2s;
-            text-align: center;
-            text-decoration: none;
-        }}
-        .btn-primary {{
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-        }}
-        .btn-primary:hover {{
-            opacity: 0.9;
-            transform: translateY(-1px);
-        }}
-        .btn-secondary {{
-            background: #f3f4f6;
-            color: #374151;
-            border: 1px solid #d1d5db;
-        }}
-        .btn-secondary:hover {{
-            background: #e5e7eb;
-        }}
-        .btn-danger {{
-            background: #fee2e2;
-            color: #dc2626;
-            border: 1px solid #fca5a5;
-        }}
-        .btn-danger:hover {{
-            background: #fecaca;
-        }}
-        .note {{
-            background: #eff6ff;
-            border: 1px solid #93c5fd;
-            border-radius: 8px;
-            padding: 12px;
-            margin-top: 20px;
-            color: #1e40af;
-            font-size: 13px;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <div class="avatar">👤</div>
-            <h1>欢迎回来，{user.get('name', '用户')}!</h1>
-            <p class="subtitle">AI Intent Center 用户中心</p>
-        </div>
-        
-        <div class="info-card">
-            <div class="info-item">
-                <span class="info-label">飞书 ID</span>
-                <span class="info-value">{user.get('open_id', '-')[:20]}...</span>
-            </div>
-            <div class="info-item">
-                <span class="info-label">状态</span>
-                <span class="info-value">{'✅ 已启用' if user.get('is_active') else '❌ 已禁用'}</span>
-            </div>
-            <div class="info-item">
-                <span class="info-label">注册时间</span>
-                <span class="info-value">{user.get('created_at', '-')}</span>
-            </div>
-        </div>
-        
-        <div class="api-key-section">
-            <div class="api-key-title">
-                🔑 您的 API Key
-            </div>
-            <div class="api-key-value" id="apiKey">{api_key}</div>
-            <button class="copy-btn" onclick="copyApiKey()">📋 复制 API Key</button>
-        </div>
-        
-        <div class="note">
-            💡 <strong>提示：</strong>您可以使用此 API Key 在 MCP 客户端中进行身份验证。
-            将此 Key 配置到您的 AI 应用中即可接收反馈消息。
-        </div>
-        
-        <div class="actions" style="margin-top: 24px;">
-            <a href="/webui?api_key={api_key}" class="btn btn-primary">💻 进入 Web UI</a>
-            <button onclick="logout()" class="btn btn-secondary">🚪 退出登录</button>
-            <a href="/" class="btn btn-secondary">🏠 返回首页</a>
-        </div>
-        
-        <div class="note" style="margin-top: 16px; background: #fef3c7; border-color: #fcd34d; color: #92400e;">
-            🔒 <strong>登录缓存：</strong>您的登录状态将保存 30 天，下次访问可直接使用。
-        </div>
-    </div>
-    
-    <script>
-        // API Key Cache Functions (30 days)
-        const API_KEY_STORAGE_KEY = 'userApiKey';
-        const API_KEY_EXPIRY_KEY = 'userApiKeyExpiry';
-        const API_KEY_CACHE_DAYS = 30;
-        
-        function saveApiKeyToCache(apiKey) {{
-            const expiryDate = new Date();
-            expiryDate.setDate(expiryDate.getDate() + API_KEY_CACHE_DAYS);
-            localStorage.setItem(API_KEY_STORAGE_KEY, apiKey);
-            localStorage.setItem(API_KEY_EXPIRY_KEY, expiryDate.getTime().toString());
-        }}
-        
-        function clearApiKeyCache() {{
-            localStorage.removeItem(API_KEY_STORAGE_KEY);
-            localStorage.removeItem(API_KEY_EXPIRY_KEY);
-        }}
-        
-        function copyApiKey() {{
-            const apiKey = document.getElementById('apiKey').textContent;
-            navigator.clipboard.writeText(apiKey).then(() => {{
-                const btn = document.querySelector('.copy-btn');
-                const originalText = btn.textContent;
-                btn.textContent = '✅ 已复制!';
-                setTimeout(() => {{
-                    btn.textContent = originalText;
-                }}, 2000);
-            }});
-        }}
-        
-        function logout() {{
-            clearApiKeyCache();
-            window.location.href = '/';
-        }}
-        
-        // Save API Key to cache on page load
-        (function() {{
-            const apiKey = document.getElementById('apiKey').textContent;
-            if (apiKey && apiKey.startsWith('uk_')) {{
-                saveApiKeyToCache(apiKey);
-            }}
-        }})();
-    </script>
-</body>
-</html>
-    """)
+    return HTMLResponse(content=_get_user_template().render(
+        name=user.get('name', '用户'),
+        open_id=user.get('open_id', '-'),
+        is_active=user.get('is_active'),
+        created_at=user.get('created_at', '-'),
+        api_key=api_key
+    ))
 
 
 @app.get("/webui")
@@ -910,21 +814,44 @@ async def webui_page(api_key: Optional[str] = None):
 # 单用户模式 API 端点（无需认证）
 # ============================================================================
 
-import sqlite3
-
 # 静态文件
 STATIC_DIR = os.path.join(SRC_DIR, "static")
 if os.path.exists(STATIC_DIR):
     app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 
+@app.middleware("http")
+async def static_cache_headers(request: Request, call_next):
+    """给静态资源挂载补上缓存头（StaticFiles 默认不发 Cache-Control）"""
+    response = await call_next(request)
+    path = request.url.path
+    if (path.startswith("/static/") or path.startswith("/app/assets/")) \
+            and "cache-control" not in response.headers:
+        response.headers["Cache-Control"] = "public, max-age=300"
+    return response
+
+
+# 浏览器对 Service Worker 的重取很频繁，从内存配 ETag 返回，
+# 不必每次 stat + 读文件
+_SW_PATH = os.path.join(STATIC_DIR, "sw.js")
+try:
+    with open(_SW_PATH, "rb") as f:
+        _SW_BYTES = f.read()
+    _SW_ETAG = f'"{hashlib.blake2b(_SW_BYTES).hexdigest()[:16]}"'
+except OSError:
+    _SW_BYTES = None
+    _SW_ETAG = None
+
+
 @app.get("/sw.js")
-async def get_sw():
+async def get_sw(request: Request):
     """Service Worker"""
-    sw_path = os.path.join(STATIC_DIR, "sw.js")
-    if os.path.exists(sw_path):
-        return FileResponse(sw_path)
-    raise HTTPException(status_code=404, detail="sw.js not found")
+    if _SW_BYTES is None:
+        raise HTTPException(status_code=404, detail="sw.js not found")
+    headers = {"ETag": _SW_ETAG, "Cache-Control": "max-age=3600"}
+    if request.headers.get("if-none-match") == _SW_ETAG:
+        return Response(status_code=304, headers=headers)
+    return Response(_SW_BYTES, media_type="application/javascript", headers=headers)
 
 
 class ReplyModel(BaseModel):
@@ -941,7 +868,7 @@ class DeleteHistoryModel(BaseModel):
 
 def init_intent_db():
     """初始化 intent_queue 表"""
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_write_conn(DB_PATH) as conn:
         conn.execute('''
             CREATE TABLE IF NOT EXISTS intent_queue (
                 id TEXT PRIMARY KEY,
@@ -954,6 +881,35 @@ def init_intent_db():
                 completed_at TIMESTAMP
             )
         ''')
+        # 表可能先由 core.init_db 按单租户结构建出（导入本模块就会
+        # 导入 core），那份结构没有 user_id 列，先补齐再建索引
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(intent_queue)")}
+        if 'user_id' not in cols:
+            conn.execute("ALTER TABLE intent_queue ADD COLUMN user_id TEXT")
+        # 历史查询按 (status, completed_at) 过滤并倒序取前 50 条，
+        # 复合索引反向扫描即可，省掉排序步骤
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_intent_status_completed
+            ON intent_queue(status, completed_at)
+        ''')
+        # 轮询只看未完成的小集合，部分索引不随历史增长
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_intent_pending
+            ON intent_queue(id) WHERE status='PENDING'
+        ''')
+        # 带登录的轮询按 (user_id, status) 过滤，复合索引直接定位
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_intent_user_status
+            ON intent_queue(user_id, status)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_settings (
+                user_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                PRIMARY KEY (user_id, key)
+            )
+        ''')
 
 
 def _get_api_key_from_header(authorization: Optional[str]) -> Optional[str]:
@@ -981,44 +937,51 @@ async def poll_question(authorization: Optional[str] = Header(None)):
     - 如果不提供 API Key：只返回公共消息（user_id IS NULL）
     - 如果 API Key 无效：返回空列表
     """
-    init_intent_db()
     api_key = _get_api_key_from_header(authorization)
-    
-    with sqlite3.connect(DB_PATH) as conn:
-        if api_key:
-            # 飞书用户模式：根据 API Key 查找用户，只返回该用户的消息
-            user_manager = get_user_manager()
-            user = user_manager.get_user_by_api_key(api_key)
-            
-            if user:
+
+    def _poll_sync():
+        with get_read_conn(DB_PATH) as conn:
+            if api_key:
+                # 飞书用户模式：根据 API Key 查找用户，只返回该用户的消息
+                user_manager = get_user_manager()
+                user = user_manager.get_user_by_api_key(api_key)
+
+                if not user:
+                    # 无效 API Key：返回空列表
+                    return []
                 # 有效用户：只返回该用户的消息
                 cursor = conn.execute(
                     "SELECT id, question FROM intent_queue WHERE status = 'PENDING' AND user_id = ?",
                     (user["open_id"],)
                 )
             else:
-                # 无效 API Key：返回空列表
-                return []
-        else:
-            # 无登录模式：只返回公共消息（user_id IS NULL）
-            cursor = conn.execute(
-                "SELECT id, question FROM intent_queue WHERE status = 'PENDING' AND user_id IS NULL"
-            )
-        
-        rows = cursor.fetchall()
-    
+                # 无登录模式：只返回公共消息（user_id IS NULL）
+                cursor = conn.execute(
+                    "SELECT id, question FROM intent_queue WHERE status = 'PENDING' AND user_id IS NULL"
+                )
+
+            return cursor.fetchall()
+
+    rows = await run_db(_poll_sync)
     return [{"id": row[0], "question": row[1]} for row in rows]
 
 
 @app.post("/api/reply")
 async def receive_reply(reply: ReplyModel):
     """接收问题的回复"""
-    init_intent_db()
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            "UPDATE intent_queue SET answer = ?, image = ?, status = 'COMPLETED', completed_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (reply.answer, reply.image, reply.id)
-        )
+    # RETURNING 让一条语句同时完成更新和存在性确认，
+    # 不用再补一次 SELECT
+    def _reply_sync():
+        with get_write_conn(DB_PATH) as conn:
+            return conn.execute(
+                "UPDATE intent_queue SET answer = ?, image = ?, status = 'COMPLETED', completed_at = CURRENT_TIMESTAMP WHERE id = ? RETURNING id",
+                (reply.answer, reply.image, reply.id)
+            ).fetchone()
+
+    if await run_db(_reply_sync) is None:
+        raise HTTPException(status_code=404, detail="Request not found")
+    # 立即唤醒等待中的 MCP 协程（同进程），无需等下一轮轮询
+    notify_reply(reply.id)
     return {"status": "success"}
 
 
@@ -1077,13 +1040,15 @@ async def get_feishu_notify_status(authorization: Optional[str] = Header(None)):
         return JSONResponse(status_code=404, content={"error": "User not found"})
     
     # 从用户配置中获取飞书通知状态
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute(
-            "SELECT value FROM user_settings WHERE user_id = ? AND key = 'feishu_notify_enabled'",
-            (user["open_id"],)
-        )
-        row = cursor.fetchone()
-        enabled = row[0] == "1" if row else False
+    def _status_sync():
+        with get_read_conn(DB_PATH) as conn:
+            return conn.execute(
+                "SELECT value FROM user_settings WHERE user_id = ? AND key = 'feishu_notify_enabled'",
+                (user["open_id"],)
+            ).fetchone()
+
+    row = await run_db(_status_sync)
+    enabled = row[0] == "1" if row else False
     
     return {"enabled": enabled, "open_id": user["open_id"]}
 
@@ -1108,40 +1073,41 @@ async def set_feishu_notify_status(
     if not user:
         return JSONResponse(status_code=404, content={"error": "User not found"})
     
-    # 确保 user_settings 表存在
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_settings (
-                user_id TEXT NOT NULL,
-                key TEXT NOT NULL,
-                value TEXT,
-                PRIMARY KEY (user_id, key)
-            )
-        ''')
-        
-        # 更新或插入设置
-        conn.execute('''
-            INSERT OR REPLACE INTO user_settings (user_id, key, value)
-            VALUES (?, 'feishu_notify_enabled', ?)
-        ''', (user["open_id"], "1" if request.enabled else "0"))
-        conn.commit()
-    
+    def _set_sync():
+        with get_write_conn(DB_PATH) as conn:
+            # 更新或插入设置（user_settings 表由启动时的 init_intent_db 创建）
+            conn.execute('''
+                INSERT OR REPLACE INTO user_settings (user_id, key, value)
+                VALUES (?, 'feishu_notify_enabled', ?)
+            ''', (user["open_id"], "1" if request.enabled else "0"))
+
+    await run_db(_set_sync)
+
+    # 使 core 的用户信息缓存失效，下次 MCP 调用读到新设置
+    from core import _invalidate_user_cache
+    _invalidate_user_cache()
+
     return {"success": True, "enabled": request.enabled}
 
 
 @app.get("/api/history")
-async def get_history():
-    """返回已完成的问题历史"""
-    init_intent_db()
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute(
-            """SELECT id, question, answer, completed_at 
-               FROM intent_queue 
-               WHERE status = 'COMPLETED' 
-               ORDER BY completed_at DESC
-               LIMIT 50"""
-        )
-        rows = cursor.fetchall()
+async def get_history(limit: int = 50, offset: int = 0):
+    """返回已完成的问题历史（分页）"""
+    limit = min(max(limit, 0), 200)
+    offset = max(offset, 0)
+
+    def _history_sync():
+        with get_read_conn(DB_PATH) as conn:
+            return conn.execute(
+                """SELECT id, question, answer, completed_at
+                   FROM intent_queue
+                   WHERE status = 'COMPLETED'
+                   ORDER BY completed_at DESC
+                   LIMIT ? OFFSET ?""",
+                (limit, offset)
+            ).fetchall()
+
+    rows = await run_db(_history_sync)
     return [
         {
             "id": row[0], 
@@ -1156,13 +1122,14 @@ async def get_history():
 @app.get("/api/request/{request_id}")
 async def get_request_detail(request_id: str):
     """获取单个请求的详情"""
-    init_intent_db()
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute(
-            "SELECT id, question, answer, status, created_at, completed_at FROM intent_queue WHERE id = ?",
-            (request_id,)
-        )
-        row = cursor.fetchone()
+    def _detail_sync():
+        with get_read_conn(DB_PATH) as conn:
+            return conn.execute(
+                "SELECT id, question, answer, status, created_at, completed_at FROM intent_queue WHERE id = ?",
+                (request_id,)
+            ).fetchone()
+
+    row = await run_db(_detail_sync)
     
     if not row:
         raise HTTPException(status_code=404, detail="Request not found")
@@ -1180,38 +1147,51 @@ async def get_request_detail(request_id: str):
 @app.delete("/api/request/{request_id}")
 async def delete_request(request_id: str):
     """忽略/取消一个请求"""
-    init_intent_db()
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            "UPDATE intent_queue SET status = 'DISMISSED' WHERE id = ?",
-            (request_id,)
-        )
+    def _dismiss_sync():
+        with get_write_conn(DB_PATH) as conn:
+            return conn.execute(
+                "UPDATE intent_queue SET status = 'DISMISSED' WHERE id = ? RETURNING id",
+                (request_id,)
+            ).fetchone()
+
+    if await run_db(_dismiss_sync) is None:
+        raise HTTPException(status_code=404, detail="Request not found")
+    notify_reply(request_id)
     return {"status": "dismissed"}
 
 
 @app.delete("/api/history/{history_id}")
 async def delete_history_item(history_id: str):
     """删除一条历史记录"""
-    init_intent_db()
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            "DELETE FROM intent_queue WHERE id = ? AND status = 'COMPLETED'",
-            (history_id,)
-        )
+    def _delete_sync():
+        with get_write_conn(DB_PATH) as conn:
+            return conn.execute(
+                "DELETE FROM intent_queue WHERE id = ? AND status = 'COMPLETED' RETURNING id",
+                (history_id,)
+            ).fetchone()
+
+    if await run_db(_delete_sync) is None:
+        raise HTTPException(status_code=404, detail="History item not found")
     return {"status": "deleted"}
 
 
 @app.post("/api/history/delete")
 async def delete_history_batch(data: DeleteHistoryModel):
     """批量删除历史记录"""
-    init_intent_db()
-    with sqlite3.connect(DB_PATH) as conn:
-        placeholders = ','.join(['?' for _ in data.ids])
-        conn.execute(
-            f"DELETE FROM intent_queue WHERE id IN ({placeholders}) AND status = 'COMPLETED'",
-            data.ids
-        )
-    return {"status": "deleted", "count": len(data.ids)}
+    # 单事务 executemany：整批一次 fsync，也避开 IN(...) 的
+    # 解析开销和 999 个参数的上限
+    def _delete_batch_sync():
+        with get_write_conn(DB_PATH) as conn:
+            cursor = conn.executemany(
+                "DELETE FROM intent_queue WHERE id = ? AND status = 'COMPLETED'",
+                [(x,) for x in data.ids]
+            )
+            # executemany 的 rowcount 累加每条语句的改动数，
+            # 拿到真实删除数而不是请求里的 id 数
+            return cursor.rowcount
+
+    deleted = await run_db(_delete_batch_sync)
+    return {"status": "deleted", "count": deleted}
 
 
 # 飞书配置（单用户模式）
@@ -1249,6 +1229,12 @@ async def health_check():
     return {"status": "ok", "timestamp": int(time.time())}
 
 
+@app.get("/api/admin/db/pool-health")
+async def db_pool_health(_: bool = Depends(verify_admin_session)):
+    """连接池状态（每个数据库的空闲读连接数与写锁占用）"""
+    return pool_stats()
+
+
 # ============================================================================
 # React 前端静态文件服务（生产模式）
 # ============================================================================
@@ -104,7 +104,7 @@ class TestAdminAuth:
         session_token = auth.create_session()
         
         assert session_token is not None
-        assert len(session_token) == 64  # SHA256 hex
+        assert len(session_token) == 43  # token_urlsafe(32)
     
     def test_validate_admin_session(self):
         """测试：验证管理员会话"""
@@ -147,7 +147,7 @@ class TestFeishuOAuth:
         assert "open.feishu.cn" in url
         assert "cli_test123" in url
         assert state is not None
-        assert len(state) == 32
+        assert len(state) == 22  # token_urlsafe(16)
     
     def test_validate_oauth_state(self):
         """测试：验证 OAuth state 参数（防止 CSRF）"""
@@ -404,9 +404,9 @@ class TestApiKeyAuth:
         )
         api_key = user["api_key"]
         
-        # API Key 格式: uk_<32位随机字符>
+        # API Key 格式: uk_<24位随机字符>
         assert api_key.startswith("uk_")
-        assert len(api_key) == 35  # "uk_" + 32 characters
+        assert len(api_key) == 27  # "uk_" + token_urlsafe(18)
     
     def test_environment_api_key_auth(self):
         """测试：通过环境变量中的 API Key 认证用户"""
@@ -703,6 +703,186 @@ class TestWebAPI:
         assert data["api_key"] == api_key
 
 
+# ============================================================================
+# 7. 登录/回调限流测试
+# ============================================================================
+
+class TestRateLimiting:
+    """登录与 OAuth 回调限流测试"""
+
+    def setup_method(self):
+        """每个测试方法前重置数据库和限流桶"""
+        if os.path.exists(TEST_DB_PATH):
+            os.remove(TEST_DB_PATH)
+        import web_multi_tenant
+        web_multi_tenant._login_limiter._buckets.clear()
+        web_multi_tenant._callback_limiter._buckets.clear()
+
+    def teardown_method(self):
+        """清空限流桶，避免影响同进程的其他测试"""
+        import web_multi_tenant
+        web_multi_tenant._login_limiter._buckets.clear()
+        web_multi_tenant._callback_limiter._buckets.clear()
+
+    def test_login_rate_limited_after_burst(self):
+        """测试：连续失败登录触发 429 且带 Retry-After"""
+        from fastapi.testclient import TestClient
+        from web_multi_tenant import app
+
+        with TestClient(app) as client:
+            client.post("/api/system/initialize", json={
+                "admin_password": "SecurePass123!"
+            })
+
+            # 前 5 次是正常的 401，桶空后变 429
+            for _ in range(5):
+                response = client.post("/api/admin/login", json={
+                    "password": "WrongPass!"
+                })
+                assert response.status_code == 401
+
+            response = client.post("/api/admin/login", json={
+                "password": "WrongPass!"
+            })
+            assert response.status_code == 429
+            assert int(response.headers["Retry-After"]) > 0
+
+    def test_login_retry_after_grows(self):
+        """测试：继续碰壁时 Retry-After 不会缩短"""
+        from fastapi.testclient import TestClient
+        from web_multi_tenant import app
+
+        with TestClient(app) as client:
+            client.post("/api/system/initialize", json={
+                "admin_password": "SecurePass123!"
+            })
+
+            for _ in range(5):
+                client.post("/api/admin/login", json={"password": "WrongPass!"})
+
+            first = client.post("/api/admin/login", json={"password": "WrongPass!"})
+            second = client.post("/api/admin/login", json={"password": "WrongPass!"})
+
+            assert first.status_code == 429 and second.status_code == 429
+            assert (int(second.headers["Retry-After"])
+                    >= int(first.headers["Retry-After"]))
+
+    def test_login_buckets_keyed_by_username(self):
+        """测试：不同用户名使用独立的限流桶"""
+        from fastapi.testclient import TestClient
+        from web_multi_tenant import app
+
+        with TestClient(app) as client:
+            client.post("/api/system/initialize", json={
+                "admin_password": "SecurePass123!"
+            })
+
+            for _ in range(6):
+                client.post("/api/admin/login", json={"password": "WrongPass!"})
+
+            # admin 的桶已空，其他用户名仍然得到正常的 401
+            response = client.post("/api/admin/login", json={
+                "username": "other",
+                "password": "WrongPass!"
+            })
+            assert response.status_code == 401
+
+    def test_callback_rate_limited(self):
+        """测试：OAuth 回调按 IP 限流"""
+        from fastapi.testclient import TestClient
+        from web_multi_tenant import app
+
+        with TestClient(app) as client:
+            codes = [
+                client.get("/auth/feishu/callback",
+                           follow_redirects=False).status_code
+                for _ in range(21)
+            ]
+
+            # 桶内的请求因缺少参数得到 400，超出后变 429
+            assert codes[0] == 400
+            assert 429 in codes
+
+
+# ============================================================================
+# 8. 缺行返回 404 测试
+# ============================================================================
+
+class TestMissingRowResponses:
+    """回复/忽略/删除不存在的行时返回 404"""
+
+    def setup_method(self):
+        """每个测试方法前重置数据库"""
+        if os.path.exists(TEST_DB_PATH):
+            os.remove(TEST_DB_PATH)
+
+    def _seed_completed(self, db_path, ids):
+        """直接写入几条已完成的记录"""
+        conn = sqlite3.connect(db_path)
+        conn.executemany(
+            "INSERT INTO intent_queue (id, question, answer, status, completed_at) "
+            "VALUES (?, 'q', 'a', 'COMPLETED', datetime('now'))",
+            [(x,) for x in ids]
+        )
+        conn.commit()
+        conn.close()
+
+    def test_reply_unknown_id_returns_404(self):
+        """测试：回复不存在的请求返回 404"""
+        from fastapi.testclient import TestClient
+        from web_multi_tenant import app
+
+        with TestClient(app) as client:
+            response = client.post("/api/reply", json={
+                "id": "no_such_request",
+                "answer": "hello"
+            })
+            assert response.status_code == 404
+
+    def test_dismiss_unknown_id_returns_404(self):
+        """测试：忽略不存在的请求返回 404"""
+        from fastapi.testclient import TestClient
+        from web_multi_tenant import app
+
+        with TestClient(app) as client:
+            response = client.delete("/api/request/no_such_request")
+            assert response.status_code == 404
+
+    def test_delete_history_unknown_id_returns_404(self):
+        """测试：删除不存在的历史记录返回 404"""
+        from fastapi.testclient import TestClient
+        from web_multi_tenant import app
+
+        with TestClient(app) as client:
+            response = client.delete("/api/history/no_such_history")
+            assert response.status_code == 404
+
+    def test_delete_history_existing_then_missing(self):
+        """测试：删除成功后再删同一条返回 404"""
+        from fastapi.testclient import TestClient
+        from web_multi_tenant import app, DB_PATH
+
+        with TestClient(app) as client:
+            self._seed_completed(DB_PATH, ["h1"])
+
+            assert client.delete("/api/history/h1").json() == {"status": "deleted"}
+            assert client.delete("/api/history/h1").status_code == 404
+
+    def test_batch_delete_reports_actual_count(self):
+        """测试：批量删除返回真实删除数而不是请求的 id 数"""
+        from fastapi.testclient import TestClient
+        from web_multi_tenant import app, DB_PATH
+
+        with TestClient(app) as client:
+            self._seed_completed(DB_PATH, ["b1", "b2"])
+
+            response = client.post("/api/history/delete", json={
+                "ids": ["b1", "b2", "missing"]
+            })
+            assert response.status_code == 200
+            assert response.json() == {"status": "deleted", "count": 2}
+
+
 # ============================================================================
 # 清理
 # ============================================================================